@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+'''
+End to end benchmarks for the collector against the simulated SensorFS
+RestAPI server in simserver.py. The server runs in its own process so the
+CPU figures are for the client side only.
+
+Scenarios:
+	read - RestClient.read of every sensor in turn
+	read_many - one RestClient.read_many of every sensor per cycle
+	collect - the collector's collect() cycle from get-data.py
+
+For each scenario throughput, cycle time percentiles and CPU time per
+reading are reported. Run with --no-batch to compare a server without
+read_many, and with --dead/--slow/--error-rate to see how failures cost.
+'''
+import os
+import sys
+import json
+import time
+import socket
+import tempfile
+import argparse
+import importlib.util
+import multiprocessing
+
+bench_dir = os.path.dirname(os.path.realpath(__file__))
+prog_dir = os.path.dirname(bench_dir)
+sys.path.insert(0,prog_dir)
+sys.path.insert(0,bench_dir)
+
+from dflib import rest
+from dflib.metrics import Metrics
+from dflib.poller import Poller
+from dflib.publish import DataPublisher
+import simserver
+
+def load_collector():
+	'''
+	import get-data.py as a module. It changes directory on import so the
+	current directory is restored afterwards.
+	'''
+	cwd = os.getcwd()
+	spec = importlib.util.spec_from_file_location('get_data',os.path.join(prog_dir,'get-data.py'))
+	module = importlib.util.module_from_spec(spec)
+	try:
+		spec.loader.exec_module(module)
+	finally:
+		os.chdir(cwd)
+	return module
+
+def percentile(samples,p):
+	''' p'th percentile of samples by nearest rank '''
+	if not samples:
+		return None
+	ordered = sorted(samples)
+	i = max(0,min(len(ordered)-1,int(round(p / 100 * len(ordered) + .5)) - 1))
+	return ordered[i]
+
+def run_scenario(name,cycles,cycle):
+	'''
+	call cycle() cycles times. cycle returns (readings, errors). Return a
+	dict of results.
+	'''
+	times = []
+	readings = errors = 0
+	cpu_start = time.process_time()
+	wall_start = time.perf_counter()
+	for i in range(cycles):
+		started = time.perf_counter()
+		n, e = cycle()
+		times.append((time.perf_counter() - started) * 1000)
+		readings += n
+		errors += e
+	wall = time.perf_counter() - wall_start
+	cpu = time.process_time() - cpu_start
+	return {
+		'scenario': name,
+		'cycles': cycles,
+		'readings': readings,
+		'errors': errors,
+		'readings_per_sec': readings / wall if wall else None,
+		'cycle_ms_p50': percentile(times,50),
+		'cycle_ms_p90': percentile(times,90),
+		'cycle_ms_p99': percentile(times,99),
+		'cycle_ms_max': max(times),
+		'cpu_ms_per_reading': cpu * 1000 / readings if readings else None
+	}
+
+def is_error(data):
+	return type(data) is not dict or 'error' in data
+
+def bench_read(server,pairs):
+	''' every sensor read with RestClient.read, one after another '''
+	clients = [rest.RestClient(server=server,host=h,sensor=s) for h,s in pairs]
+	def cycle():
+		results = [c.read() for c in clients]
+		return len(results), len([r for r in results if is_error(r)])
+	return cycle
+
+def bench_read_many(server,pairs):
+	''' every sensor read with one RestClient.read_many '''
+	client = rest.RestClient(server=server,host='none',sensor='none')
+	def cycle():
+		results = client.read_many(pairs)
+		return len(results), len([r for r in results if is_error(r)])
+	return cycle
+
+def bench_collect(server,pairs,data_dir,workers,per_host):
+	''' the collector's collect() cycle, publishing to data_dir '''
+	collector = load_collector()
+	poller = Poller(workers=workers,per_host=per_host)
+	publisher = DataPublisher(data_dir)
+	metrics = Metrics()
+	def cycle():
+		outcome = collector.collect(poller,server,pairs,publisher,metrics)
+		return len(outcome), len([ok for pair,ok in outcome if not ok])
+	return cycle
+
+def serve(config,port):
+	''' entry point of the server process '''
+	simserver.SimServer(config,port=port).serve_forever()
+
+def wait_for_server(port,timeout=5):
+	''' wait until the server process accepts connections '''
+	deadline = time.monotonic() + timeout
+	while time.monotonic() < deadline:
+		try:
+			with socket.create_connection(('127.0.0.1',port),timeout=.2):
+				return True
+		except OSError:
+			time.sleep(.05)
+	return False
+
+def print_table(results):
+	columns = ['scenario','readings','errors','readings_per_sec','cycle_ms_p50','cycle_ms_p90','cycle_ms_p99','cycle_ms_max','cpu_ms_per_reading']
+	print(' '.join(f'{c:>18}' for c in columns))
+	for r in results:
+		cells = []
+		for c in columns:
+			v = r[c]
+			cells.append(f'{v:>18.2f}' if type(v) is float else f'{str(v):>18}')
+		print(' '.join(cells))
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(
+			prog="bench",
+			description="Collector benchmarks against a simulated SensorFS RestAPI server",
+			epilog="A SensorFS RestAPI Example. See https://github.com/nicciniamh/sensorfs"
+		)
+	parser.add_argument('--port',type=int,default=14242,help='port for the simulated server')
+	parser.add_argument('--cycles',type=int,default=20,help='cycles per scenario')
+	parser.add_argument('--workers',type=int,default=16,help='collector worker threads')
+	parser.add_argument('--per-host',type=int,default=2,help='collector reads in flight per host')
+	parser.add_argument('--scenario',action='append',choices=['read','read_many','collect'],help='scenario to run, default all')
+	parser.add_argument('--json',action='store_true',default=False,help='print results as JSON')
+	simserver.add_arguments(parser)
+	args = parser.parse_args()
+
+	config = simserver.config_from_args(args)
+	server_process = multiprocessing.Process(target=serve,args=(config,args.port),daemon=True)
+	server_process.start()
+	if not wait_for_server(args.port):
+		print('simulated server did not start',file=sys.stderr)
+		sys.exit(1)
+
+	rest.api_port = args.port
+	rest.set_pool_options(pool_size=args.workers)
+	server = '127.0.0.1'
+	pairs = config.pairs()
+	scenarios = args.scenario or ['read','read_many','collect']
+	results = []
+	with tempfile.TemporaryDirectory() as data_dir:
+		for name in scenarios:
+			if name == 'read':
+				cycle = bench_read(server,pairs)
+			elif name == 'read_many':
+				cycle = bench_read_many(server,pairs)
+			else:
+				cycle = bench_collect(server,pairs,data_dir,args.workers,args.per_host)
+			''' one untimed cycle to open connections and learn batch support '''
+			cycle()
+			results.append(run_scenario(name,args.cycles,cycle))
+	server_process.terminate()
+
+	if args.json:
+		print(json.dumps(results,indent=2))
+	else:
+		print(f'{len(pairs)} sensors on {config.hosts} hosts, latency {config.latency}+{config.jitter}ms')
+		print_table(results)
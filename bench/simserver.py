@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+'''
+A stand-in for the SensorFS RestAPI server for benchmarks and load tests.
+It answers read, read_many, list and hosts for a configurable set of hosts
+and sensors, with per-host latency and jitter, an error rate and hosts that
+are dead (they answer with an error after a long delay, as the real server
+does when a sensor host does not respond).
+'''
+import sys
+import json
+import time
+import random
+import argparse
+import threading
+import urllib.parse
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+class SimConfig(object):
+	'''
+	Simulation settings.
+	kwargs:
+		hosts - number of sensor hosts (default 4)
+		sensors - sensors per host (default 3)
+		latency - base latency per read in ms (default 20)
+		jitter - random extra latency per read in ms (default 10)
+		host_latency - dict of host name: latency in ms overriding latency
+		error_rate - fraction of reads answered with an error (default 0)
+		dead - list of dead host names (default none)
+		dead_delay - how long a dead host takes to fail in ms (default 2000)
+		batch - answer read_many requests (default True)
+		seed - random seed (default None)
+	'''
+	def __init__(self,**kwargs):
+		self.hosts = 4
+		self.sensors = 3
+		self.latency = 20
+		self.jitter = 10
+		self.host_latency = {}
+		self.error_rate = 0
+		self.dead = []
+		self.dead_delay = 2000
+		self.batch = True
+		self.seed = None
+		for k,v in kwargs.items():
+			if k in ['hosts','sensors','latency','jitter','host_latency','error_rate','dead','dead_delay','batch','seed']:
+				setattr(self,k,v)
+			else:
+				raise ValueError(f'Invalid keyword argument {k}')
+		self.random = random.Random(self.seed)
+
+	def host_names(self):
+		return [f'host{i}' for i in range(self.hosts)]
+
+	def sensor_names(self,host):
+		return [f'sensor{i}' for i in range(self.sensors)]
+
+	def pairs(self):
+		''' every (host, sensor) pair served '''
+		return [(h,s) for h in self.host_names() for s in self.sensor_names(h)]
+
+	def delay(self,host):
+		''' seconds a read from host takes '''
+		if host in self.dead:
+			return self.dead_delay / 1000
+		latency = self.host_latency.get(host,self.latency)
+		return (latency + self.random.uniform(0,self.jitter)) / 1000
+
+	def reading(self,host,sensor):
+		''' a reading, or an error, for host and sensor '''
+		if host in self.dead:
+			return {'error': 'host unreachable'}
+		if not host in self.host_names() or not sensor in self.sensor_names(host):
+			return {'error': 'no such sensor'}
+		if self.error_rate and self.random.random() < self.error_rate:
+			return {'error': 'simulated error'}
+		return {
+			'name': sensor,
+			'description': f'simulated sensor {sensor}',
+			'modinfo': 'simserver',
+			'time': time.time(),
+			'temp': round(self.random.uniform(60,85),2),
+			'humidity': round(self.random.uniform(20,60),2)
+		}
+
+class SimHandler(BaseHTTPRequestHandler):
+	''' request handler, the SimConfig is server.config '''
+	protocol_version = 'HTTP/1.1'
+	''' headers and body go out in separate writes, without this Nagle and delayed ACK add ~40ms to each request '''
+	disable_nagle_algorithm = True
+
+	def do_GET(self):
+		config = self.server.config
+		url = urllib.parse.urlparse(self.path)
+		query = {k: v[0] for k,v in urllib.parse.parse_qs(url.query).items()}
+		command = url.path.strip('/')
+		if command == 'read':
+			host = query.get('host')
+			time.sleep(config.delay(host))
+			self.reply(config.reading(host,query.get('sensor')))
+		elif command == 'read_many' and config.batch:
+			keys = [k for k in query.get('sensors','').split(',') if ':' in k]
+			pairs = [k.split(':',1) for k in keys]
+			''' a batch costs the slowest host in it, as the server reads hosts in parallel '''
+			delays = [config.delay(host) for host in set(h for h,s in pairs)]
+			time.sleep(max(delays) if delays else 0)
+			self.reply({k: config.reading(h,s) for k,(h,s) in zip(keys,pairs)})
+		elif command == 'list':
+			self.reply(config.sensor_names(query.get('host')))
+		elif command == 'hosts':
+			self.reply(config.host_names())
+		else:
+			self.send_response(404)
+			self.send_header('Content-Length','0')
+			self.end_headers()
+
+	def reply(self,data):
+		body = json.dumps(data).encode('utf-8')
+		self.send_response(200)
+		self.send_header('Content-Type','application/json')
+		self.send_header('Content-Length',str(len(body)))
+		self.end_headers()
+		self.wfile.write(body)
+
+	def log_message(self,*args):
+		pass
+
+class SimServer(ThreadingHTTPServer):
+	''' the simulated server, call serve_forever() or start() for a thread '''
+	daemon_threads = True
+
+	def __init__(self,config,address='127.0.0.1',port=4242):
+		self.config = config
+		super().__init__((address,port),SimHandler)
+
+	def start(self):
+		''' serve on a background thread '''
+		thread = threading.Thread(target=self.serve_forever,name='simserver',daemon=True)
+		thread.start()
+		return thread
+
+def add_arguments(parser):
+	''' add the simulation options to an argparse parser '''
+	parser.add_argument('--hosts',type=int,default=4,help='number of sensor hosts')
+	parser.add_argument('--sensors',type=int,default=3,help='sensors per host')
+	parser.add_argument('--latency',type=float,default=20,help='base read latency in ms')
+	parser.add_argument('--jitter',type=float,default=10,help='random extra latency in ms')
+	parser.add_argument('--slow',action='append',default=[],metavar='HOST=MS',help='latency for one host')
+	parser.add_argument('--error-rate',type=float,default=0,help='fraction of reads that fail')
+	parser.add_argument('--dead',action='append',default=[],metavar='HOST',help='a dead host')
+	parser.add_argument('--dead-delay',type=float,default=2000,help='ms a dead host takes to fail')
+	parser.add_argument('--no-batch',action='store_true',default=False,help='do not answer read_many')
+	parser.add_argument('--seed',type=int,default=None,help='random seed')
+
+def config_from_args(args):
+	''' build a SimConfig from parsed add_arguments options '''
+	host_latency = {}
+	for slow in args.slow:
+		host, ms = slow.split('=')
+		host_latency[host] = float(ms)
+	return SimConfig(
+		hosts=args.hosts,
+		sensors=args.sensors,
+		latency=args.latency,
+		jitter=args.jitter,
+		host_latency=host_latency,
+		error_rate=args.error_rate,
+		dead=args.dead,
+		dead_delay=args.dead_delay,
+		batch=not args.no_batch,
+		seed=args.seed)
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(
+			prog="simserver",
+			description="Simulated SensorFS RestAPI server",
+			epilog="A SensorFS RestAPI Example. See https://github.com/nicciniamh/sensorfs"
+		)
+	parser.add_argument('--port',type=int,default=4242,help='port to listen on')
+	add_arguments(parser)
+	args = parser.parse_args()
+	server = SimServer(config_from_args(args),port=args.port)
+	print(f'Serving {args.hosts} hosts x {args.sensors} sensors on port {args.port}',file=sys.stderr)
+	try:
+		server.serve_forever()
+	except KeyboardInterrupt:
+		pass
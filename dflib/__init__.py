@@ -3,7 +3,16 @@ A set of tools to help run this mess.
 Modules to import are:
 	cfgjson: JSON based configuration
 	debug: Debugging tools
+	history: In memory history of sensor readings
+	metrics: Daemon metrics and histograms
+	pixcache: Cache of rendered icon pixbufs
+	poller: Concurrent sensor polling
+	pollplan: Poll plan compiled from sensors.json
+	publish: Atomic publication of sensor data files
+	push: Unix socket push channel from the daemon to the GUI
 	rest: RESTApi tools
+	sensorinfo: Sensor metadata captured by the daemon
+	shmstore: Memory mapped sensor store
 	theme: Gtk theme tools
 	widgets: Enhanced Gtk Widgets
 '''
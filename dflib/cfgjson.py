@@ -0,0 +1,92 @@
+'''
+JSON based configuration with write-behind saving.
+Changes are made to the config dict in memory and save() only marks it
+dirty; the file is written once the changes stop for a moment (or at the
+latest after max_delay), replaced atomically so the daemon never sees a
+partial file, and not at all if the contents did not change. flush()
+writes straight away and is registered to run at exit.
+'''
+import json
+import time
+import atexit
+from gi.repository import GLib
+
+from dflib.debug import debug
+from dflib.publish import atomic_write
+
+class ConfigStore(object):
+	'''
+	Load and save the configuration at path.
+	kwargs:
+		delay - ms without changes before the file is written (default 500)
+		max_delay - longest ms a change waits while changes keep coming (default 5000)
+		indent - json indent of the file (default 4)
+	'''
+	def __init__(self,path,**kwargs):
+		self.path = path
+		self.delay = 500
+		self.max_delay = 5000
+		self.indent = 4
+		for k,v in kwargs.items():
+			if k in ['delay','max_delay','indent']:
+				setattr(self,k,v)
+			else:
+				raise ValueError(f'Invalid keyword argument {k}')
+		self.config = None
+		self.stats = {
+			'saves': 0,
+			'writes': 0
+		}
+		self._written = None
+		self._timer = None
+		self._first_change = None
+		self._last_change = None
+		atexit.register(self.flush)
+
+	def load(self):
+		''' read the file and return the config dict '''
+		with open(self.path) as f:
+			self._written = f.read()
+		self.config = json.loads(self._written)
+		return self.config
+
+	def save(self):
+		''' note that config changed, it is written shortly '''
+		self.stats['saves'] += 1
+		now = time.monotonic()
+		self._last_change = now
+		if not self._timer:
+			self._first_change = now
+			self._timer = GLib.timeout_add(self.delay,self._on_timer)
+
+	def _on_timer(self):
+		''' write once changes stopped for delay ms or max_delay has passed '''
+		now = time.monotonic()
+		quiet = (now - self._last_change) * 1000 >= self.delay
+		overdue = (now - self._first_change) * 1000 >= self.max_delay
+		if not quiet and not overdue:
+			return True
+		self._timer = None
+		self.flush()
+		return False
+
+	def flush(self):
+		''' write pending changes now '''
+		if self._timer:
+			GLib.source_remove(self._timer)
+			self._timer = None
+		if self._last_change is None or self.config is None:
+			return False
+		self._last_change = None
+		data = json.dumps(self.config,indent=self.indent)
+		if data == self._written:
+			return False
+		try:
+			atomic_write(self.path,data.encode('utf-8'))
+		except OSError as e:
+			debug(f'cannot write {self.path}: {e}')
+			return False
+		self._written = data
+		self.stats['writes'] += 1
+		debug("Wrote",self.path)
+		return True
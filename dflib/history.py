@@ -0,0 +1,118 @@
+'''
+In memory history of numeric sensor readings for the daemon.
+Each numeric field of each sensor gets a fixed size ring buffer of
+(time, value) samples held in array('d') storage, so memory use is fixed
+no matter how long the daemon runs. Samples are kept in time order, which
+makes range queries a pair of binary searches.
+'''
+import time
+import threading
+from array import array
+
+class Series(object):
+	''' ring buffer of (time, value) samples with room for capacity samples '''
+	def __init__(self,capacity):
+		self.capacity = capacity
+		self.times = array('d',bytes(8*capacity))
+		self.values = array('d',bytes(8*capacity))
+		self.start = 0
+		self.count = 0
+
+	def __len__(self):
+		return self.count
+
+	def _index(self,i):
+		''' physical index of the i'th oldest sample '''
+		return (self.start + i) % self.capacity
+
+	def last_time(self):
+		''' time of the newest sample or None '''
+		if not self.count:
+			return None
+		return self.times[self._index(self.count-1)]
+
+	def append(self,t,v):
+		''' add a sample, replacing the oldest one when full '''
+		if self.count < self.capacity:
+			i = self._index(self.count)
+			self.count += 1
+		else:
+			i = self.start
+			self.start = (self.start + 1) % self.capacity
+		self.times[i] = t
+		self.values[i] = v
+
+	def _bisect(self,t,after=False):
+		''' number of samples older than t, or with after set, no newer than t '''
+		lo, hi = 0, self.count
+		while lo < hi:
+			mid = (lo + hi) // 2
+			st = self.times[self._index(mid)]
+			if st < t or (after and st == t):
+				lo = mid + 1
+			else:
+				hi = mid
+		return lo
+
+	def range(self,start=None,end=None):
+		''' return a list of (time, value) with start <= time <= end '''
+		first = self._bisect(start) if start is not None else 0
+		last = self._bisect(end,after=True) if end is not None else self.count
+		return [(self.times[self._index(i)], self.values[self._index(i)]) for i in range(first,last)]
+
+class History(object):
+	'''
+	Keep a Series per (host, sensor, field).
+	kwargs:
+		capacity - samples kept per series (default 3600)
+		max_series - series kept in all; the least recently updated one is
+			dropped to make room (default 1024)
+	'''
+	def __init__(self,**kwargs):
+		self.capacity = 3600
+		self.max_series = 1024
+		for k,v in kwargs.items():
+			if k in ['capacity','max_series']:
+				setattr(self,k,v)
+			else:
+				raise ValueError(f'Invalid keyword argument {k}')
+		self._series = {}
+		self._lock = threading.Lock()
+
+	def record(self,host,sensor,data):
+		'''
+		add the numeric fields of a reading. The reading's time field is
+		used as the sample time; a reading no newer than the last one
+		recorded for a field is ignored.
+		'''
+		t = data.get('time',time.time())
+		if type(t) not in (int,float):
+			return
+		with self._lock:
+			for field,v in data.items():
+				if field == 'time' or type(v) not in (int,float):
+					continue
+				key = (host,sensor,field)
+				series = self._series.pop(key,None)
+				if not series:
+					if len(self._series) >= self.max_series:
+						del self._series[next(iter(self._series))]
+					series = Series(self.capacity)
+				last = series.last_time()
+				if last is None or t > last:
+					series.append(t,v)
+				''' re-insert so dict order is least recently updated first '''
+				self._series[key] = series
+
+	def fields(self,host,sensor):
+		''' list the fields with history for host and sensor '''
+		with self._lock:
+			return [k[2] for k in self._series if k[0] == host and k[1] == sensor]
+
+	def query(self,host,sensor,field,start=None,end=None):
+		''' return (time, value) samples for a field between start and end '''
+		with self._lock:
+			series = self._series.get((host,sensor,field))
+			if not series:
+				return []
+			return series.range(start,end)
@@ -0,0 +1,152 @@
+'''
+Metrics for the data collection daemon.
+Request latency is kept per API server, per sensor host and per sensor in
+fixed bucket histograms (hosts and sensors only from reads of a single
+sensor, batched reads have a histogram of their own), alongside error counts by kind, bytes received,
+cycle durations and data file writes. For batched reads each host gets
+counts of the batches it was in, the sensors read and the failed ones. The daemon rewrites a JSON snapshot
+of everything to a metrics file every few seconds.
+'''
+import json
+import time
+import threading
+
+from dflib.publish import atomic_write
+
+''' histogram bucket upper bounds in milliseconds, the last bucket is open ended '''
+buckets_ms = [1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000]
+
+class Histogram(object):
+	''' count of samples per bucket, with count, total and max '''
+	def __init__(self):
+		self.counts = [0] * (len(buckets_ms) + 1)
+		self.count = 0
+		self.total = 0.0
+		self.max = 0.0
+
+	def add(self,ms):
+		''' add a sample in milliseconds '''
+		i = 0
+		while i < len(buckets_ms) and ms > buckets_ms[i]:
+			i += 1
+		self.counts[i] += 1
+		self.count += 1
+		self.total += ms
+		if ms > self.max:
+			self.max = ms
+
+	def percentile(self,p):
+		''' upper bound of the bucket holding the p'th percentile '''
+		if not self.count:
+			return None
+		target = self.count * p / 100
+		seen = 0
+		for i,n in enumerate(self.counts):
+			seen += n
+			if seen >= target:
+				return buckets_ms[i] if i < len(buckets_ms) else self.max
+		return self.max
+
+	def snapshot(self):
+		''' dict form of the histogram '''
+		labels = [f'<={b}' for b in buckets_ms] + [f'>{buckets_ms[-1]}']
+		return {
+			'count': self.count,
+			'mean': self.total / self.count if self.count else None,
+			'max': self.max,
+			'p50': self.percentile(50),
+			'p90': self.percentile(90),
+			'p99': self.percentile(99),
+			'buckets': dict(zip(labels,self.counts))
+		}
+
+class Metrics(object):
+	'''
+	Collect daemon metrics. request() matches the dflib.rest observer
+	signature so it can be installed with rest.observer = metrics.request.
+	sources is a dict of name: callable returning a dict of counters
+	(publisher stats, scheduler stats and so on) added to every snapshot.
+	'''
+	def __init__(self):
+		self.started = time.time()
+		self.servers = {}
+		self.hosts = {}
+		self.sensors = {}
+		self.cycles = Histogram()
+		self.batches = Histogram()
+		self.batch_sizes = Histogram()
+		self.batch_hosts = {}
+		self.errors = {}
+		self.bytes = 0
+		self.requests = 0
+		self.sources = {}
+		self._lock = threading.Lock()
+
+	def _histogram(self,table,key):
+		if not key in table:
+			table[key] = Histogram()
+		return table[key]
+
+	def request(self,server,command,seconds,nbytes,kind):
+		''' record one REST request '''
+		with self._lock:
+			self.requests += 1
+			self.bytes += nbytes
+			if kind:
+				self.errors[kind] = self.errors.get(kind,0) + 1
+			if seconds:
+				self._histogram(self.servers,server).add(seconds * 1000)
+
+	def read(self,host,sensor,seconds):
+		''' record how long a sensor took to read '''
+		with self._lock:
+			self._histogram(self.hosts,host).add(seconds * 1000)
+			self._histogram(self.sensors,f'{host}-{sensor}').add(seconds * 1000)
+
+	def batch(self,count,seconds,hosts=None):
+		'''
+		record how long a batched read of count sensors took. The time is
+		the whole batch's, so it is not charged to the hosts and sensors in it.
+		hosts maps each host in the batch to (sensors, errors), its number of
+		sensors in the batch and of those that failed.
+		'''
+		with self._lock:
+			self.batches.add(seconds * 1000)
+			self.batch_sizes.add(count)
+			for host,(sensors,errors) in (hosts or {}).items():
+				if not host in self.batch_hosts:
+					self.batch_hosts[host] = {'batches': 0, 'sensors': 0, 'errors': 0}
+				counts = self.batch_hosts[host]
+				counts['batches'] += 1
+				counts['sensors'] += sensors
+				counts['errors'] += errors
+
+	def cycle(self,seconds):
+		''' record how long a collection cycle took '''
+		with self._lock:
+			self.cycles.add(seconds * 1000)
+
+	def snapshot(self):
+		''' dict of every metric '''
+		with self._lock:
+			snap = {
+				'time': time.time(),
+				'uptime': time.time() - self.started,
+				'requests': self.requests,
+				'bytes': self.bytes,
+				'errors': dict(self.errors),
+				'cycles': self.cycles.snapshot(),
+				'batches': self.batches.snapshot(),
+				'batch_sizes': self.batch_sizes.snapshot(),
+				'batch_hosts': {k: dict(v) for k,v in self.batch_hosts.items()},
+				'servers': {k: h.snapshot() for k,h in self.servers.items()},
+				'hosts': {k: h.snapshot() for k,h in self.hosts.items()},
+				'sensors': {k: h.snapshot() for k,h in self.sensors.items()},
+			}
+		for name,source in self.sources.items():
+			snap[name] = dict(source())
+		return snap
+
+	def write(self,path):
+		''' rewrite the metrics file at path '''
+		atomic_write(path,json.dumps(self.snapshot(),indent=2).encode('utf-8'))
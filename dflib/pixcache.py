@@ -0,0 +1,299 @@
+'''
+Process wide cache of rendered icon pixbufs.
+Entries are keyed by the source file's path, modification time and size
+and the rendered size, so an icon file that changes is rendered again.
+The least recently used entries are dropped when the pixel memory held
+goes over max_bytes. icon_variants() returns the scaled inactive icon and
+the active one with the badge composited over it, which is what every
+IconWindow shows.
+If thumbnails are opened with open_thumbnails() the rendered variants are
+also kept on disk, so a later start only has to load small pngs. A
+thumbnail made from an older version of its icon file is still shown while
+the icon is rendered again in the background.
+'''
+import os
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import gi
+gi.require_version('Gtk', '3.0')
+from gi.repository import GdkPixbuf, GLib
+
+from dflib.debug import debug
+from dflib.publish import atomic_write
+
+''' name of the badge drawn over active icons, it lives next to the icon '''
+badge_name = 'active_badge.png'
+
+class PixbufCache(object):
+	'''
+	LRU cache of pixbufs, or tuples of pixbufs, with a memory cap.
+	kwargs:
+		max_bytes - pixel memory to hold before old entries are dropped (default 32MB)
+	stats counts hits, misses and evictions.
+	'''
+	def __init__(self,**kwargs):
+		self.max_bytes = 32 * 1024 * 1024
+		for k,v in kwargs.items():
+			if k in ['max_bytes']:
+				setattr(self,k,v)
+			else:
+				raise ValueError(f'Invalid keyword argument {k}')
+		self.stats = {
+			'hits': 0,
+			'misses': 0,
+			'evictions': 0
+		}
+		self.bytes = 0
+		self._entries = OrderedDict()
+		self._lock = threading.Lock()
+
+	@staticmethod
+	def key(path,size):
+		''' cache key for path rendered at size, None if path cannot be read '''
+		try:
+			st = os.stat(path)
+		except OSError:
+			return None
+		return (path, st.st_mtime_ns, st.st_size, size)
+
+	@staticmethod
+	def cost(value):
+		''' bytes of pixel data held by a pixbuf or tuple of pixbufs '''
+		if type(value) is not tuple:
+			value = (value,)
+		return sum([p.get_byte_length() for p in value])
+
+	def get(self,path,size,render):
+		'''
+		return the entry for path at size, calling render(path, size) to
+		make it if it is not cached or the file changed
+		'''
+		key = self.key(path,size)
+		with self._lock:
+			if key and key in self._entries:
+				self._entries.move_to_end(key)
+				self.stats['hits'] += 1
+				return self._entries[key][0]
+			self.stats['misses'] += 1
+		value = render(path,size)
+		if key:
+			self.put(key,value)
+		return value
+
+	def put(self,key,value):
+		''' add value under key and drop old entries over the memory cap '''
+		cost = self.cost(value)
+		with self._lock:
+			if key in self._entries:
+				self.bytes -= self._entries.pop(key)[1]
+			self._entries[key] = (value,cost)
+			self.bytes += cost
+			while self.bytes > self.max_bytes and len(self._entries) > 1:
+				old_key, (old_value, old_cost) = self._entries.popitem(last=False)
+				self.bytes -= old_cost
+				self.stats['evictions'] += 1
+				debug(f'dropped {old_key[0]} from pixbuf cache')
+
+	def clear(self):
+		with self._lock:
+			self._entries.clear()
+			self.bytes = 0
+
+cache = PixbufCache()
+
+def _load(path,size):
+	return GdkPixbuf.Pixbuf.new_from_file(path)
+
+def render_variants(path,size):
+	'''
+	Create a suitable icon from a file for both regular and acive by
+	applying an image with the active badge to the source. Return both GdkPixbufs
+	'''
+	# Load images
+	image2_path = os.path.join(os.path.dirname(path),badge_name)
+	image1 = GdkPixbuf.Pixbuf.new_from_file(path)
+	image2 = cache.get(image2_path,None,_load)
+
+	# Scale image1 to the desired dimensions
+	scaled_image1 = image1.scale_simple(size, size, GdkPixbuf.InterpType.BILINEAR)
+
+	# Create a new transparent image to composite onto
+	composite_image = GdkPixbuf.Pixbuf.new(GdkPixbuf.Colorspace.RGB, True, 8, size, size)
+	composite_image.fill(0x000000)  # Fill with black
+
+	# Draw scaled_image1 onto the composite image
+	scaled_image1.copy_area(0, 0, size, size, composite_image, 0, 0)
+
+	# Calculate position to center image2 on composite_image
+	x_offset = (size - image2.get_width()) // 2
+	y_offset = (size - image2.get_height()) // 2
+
+	# Draw image2 onto the composite image
+	image2.composite(
+		composite_image,
+		x_offset,
+		y_offset,
+		image2.get_width(),
+		image2.get_height(),
+		x_offset,
+		y_offset,
+		1,
+		1,
+		GdkPixbuf.InterpType.BILINEAR,
+		255,
+	)
+	return (scaled_image1, composite_image)
+
+''' bump when render_variants draws differently, older thumbnails are then ignored '''
+thumbnail_version = 1
+
+class ThumbnailCache(object):
+	'''
+	Rendered icon variants on disk, in a directory per thumbnail_version
+	under directory. index.json maps each icon path and size to its
+	thumbnail files and the signature (mtime and size of the icon and the
+	badge) it was made from.
+	'''
+	def __init__(self,directory):
+		self.directory = os.path.join(directory,f'v{thumbnail_version}')
+		self.index_path = os.path.join(self.directory,'index.json')
+		self._index = {}
+		self._lock = threading.Lock()
+		os.makedirs(self.directory,exist_ok=True)
+		try:
+			with open(self.index_path) as f:
+				self._index = json.load(f)
+		except (OSError, ValueError) as e:
+			debug(f'starting a new thumbnail index: {e}')
+
+	@staticmethod
+	def signature(path):
+		''' mtime and size of the icon and its badge, None if the icon cannot be read '''
+		sig = []
+		for p in [path, os.path.join(os.path.dirname(path),badge_name)]:
+			try:
+				st = os.stat(p)
+			except OSError:
+				if p == path:
+					return None
+				sig.extend([0, 0])
+				continue
+			sig.extend([st.st_mtime_ns, st.st_size])
+		return sig
+
+	@staticmethod
+	def _entry_key(path,size):
+		return f'{os.path.abspath(path)}|{size}'
+
+	def fresh(self,path,size):
+		''' True if there is a thumbnail of the current icon file at path '''
+		with self._lock:
+			entry = self._index.get(self._entry_key(path,size))
+		return bool(entry) and entry['signature'] == self.signature(path)
+
+	def load(self,path,size):
+		'''
+		return (variants, fresh) for path at size, variants is None if there
+		is no usable thumbnail and fresh is False if the icon changed since it
+		was made
+		'''
+		with self._lock:
+			entry = self._index.get(self._entry_key(path,size))
+		if not entry:
+			return (None, False)
+		try:
+			variants = tuple([GdkPixbuf.Pixbuf.new_from_file(os.path.join(self.directory,f)) for f in entry['files']])
+		except GLib.Error as e:
+			debug(f'cannot load thumbnails for {path}: {e}')
+			return (None, False)
+		return (variants, entry['signature'] == self.signature(path))
+
+	def save(self,path,size,variants,signature):
+		''' write variants of path rendered from the icon with signature '''
+		key = self._entry_key(path,size)
+		name = hashlib.blake2b(key.encode('utf-8'),digest_size=12).hexdigest()
+		files = []
+		for label,pixbuf in zip(['inactive','active'],variants):
+			fname = f'{name}-{label}.png'
+			tmp_path = os.path.join(self.directory,f'{fname}.{threading.get_ident()}.tmp')
+			pixbuf.savev(tmp_path,'png',[],[])
+			os.replace(tmp_path,os.path.join(self.directory,fname))
+			files.append(fname)
+		with self._lock:
+			self._index[key] = {'signature': signature, 'files': files}
+			payload = json.dumps(self._index,indent=1).encode('utf-8')
+			atomic_write(self.index_path,payload)
+
+thumbnails = None
+_render_pool = ThreadPoolExecutor(max_workers=1,thread_name_prefix='thumbnails')
+_rendering = set()
+
+def open_thumbnails(directory):
+	''' keep rendered icons on disk under directory '''
+	global thumbnails
+	try:
+		thumbnails = ThumbnailCache(directory)
+	except OSError as e:
+		debug(f'no thumbnail cache in {directory}: {e}')
+
+def _rebuild(path,size,on_rebuilt):
+	'''
+	worker thread: render path, put it in the memory cache and on disk and
+	call on_rebuilt(path) on the main loop
+	'''
+	try:
+		signature = ThumbnailCache.signature(path)
+		variants = render_variants(path,size)
+		cache.put(cache.key(path,size),variants)
+		if thumbnails and signature:
+			thumbnails.save(path,size,variants,signature)
+	except (GLib.Error, OSError) as e:
+		debug(f'cannot render {path}: {e}')
+		return
+	finally:
+		_rendering.discard((path,size))
+	if callable(on_rebuilt):
+		GLib.idle_add(on_rebuilt,path)
+
+def _rebuild_later(path,size,on_rebuilt=None):
+	''' queue a background render of path unless one is queued already '''
+	if (path,size) in _rendering:
+		return
+	_rendering.add((path,size))
+	_render_pool.submit(_rebuild,path,size,on_rebuilt)
+
+def _render_cached(path,size,on_rebuilt):
+	''' render function for the memory cache that tries the thumbnails first '''
+	if thumbnails:
+		variants, fresh = thumbnails.load(path,size)
+		if variants and fresh:
+			return variants
+		if variants and callable(on_rebuilt):
+			''' show the old thumbnail until the new one is ready '''
+			_rebuild_later(path,size,on_rebuilt)
+			return variants
+	variants = render_variants(path,size)
+	if thumbnails:
+		signature = ThumbnailCache.signature(path)
+		if signature:
+			_render_pool.submit(thumbnails.save,path,size,variants,signature)
+	return variants
+
+def icon_variants(path,size=64,on_rebuilt=None):
+	'''
+	return (inactive, active) pixbufs for the icon file at path, from the
+	cache. If an outdated thumbnail is returned, on_rebuilt(path) is called
+	on the main loop once the icon has been rendered again.
+	'''
+	return cache.get(path,size,lambda p,s: _render_cached(p,s,on_rebuilt))
+
+def prewarm(paths,size=64):
+	''' render thumbnails for paths that have no up to date one, in the background '''
+	if not thumbnails:
+		return
+	for path in paths:
+		if not thumbnails.fresh(path,size):
+			_rebuild_later(path,size)
@@ -0,0 +1,264 @@
+'''
+Concurrent polling engine for the data collection daemon.
+Sensor reads are fanned out over a pool of worker threads so one slow
+host does not hold up every other sensor. The number of reads in flight
+for any one host is capped so a single host is not flooded.
+A Scheduler decides which sensors are due: sensors with an open detail
+window are read at the poll interval, the rest at the slower background
+interval, and sensors on a failing host back off exponentially. Reads are
+scheduled at a fixed rate from when they were due, not from when the last
+read finished, so the time spent reading does not add to the interval.
+'''
+import time
+import math
+import heapq
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, Future, wait
+
+from dflib.debug import debug
+
+class Poller(object):
+	'''
+	Run sensor reads concurrently.
+	kwargs:
+		workers - maximum number of reads in flight (default 16)
+		per_host - maximum number of reads in flight for a single host (default 2)
+		timeout - seconds to wait for a whole cycle before giving up (default 15)
+	'''
+	def __init__(self,**kwargs):
+		self.workers = 16
+		self.per_host = 2
+		self.timeout = 15
+		for k,v in kwargs.items():
+			if k in ['workers','per_host','timeout']:
+				setattr(self,k,v)
+			else:
+				raise ValueError(f'Invalid keyword argument {k}')
+		self._pool = ThreadPoolExecutor(max_workers=self.workers,thread_name_prefix='poller')
+		self._queues = {}
+		self._inflight = {}
+		self._lock = threading.Lock()
+
+	def _dispatch(self,host):
+		'''
+		hand queued reads for host to the pool while it has fewer than
+		per_host in flight. The cap is applied here rather than in the
+		workers so reads waiting for a busy host never hold a worker.
+		'''
+		with self._lock:
+			queue = self._queues.get(host)
+			while queue and self._inflight.get(host,0) < self.per_host:
+				future, func, args = queue.popleft()
+				if not future.set_running_or_notify_cancel():
+					continue
+				self._inflight[host] = self._inflight.get(host,0) + 1
+				self._pool.submit(self._run,host,future,func,args)
+
+	def _run(self,host,future,func,args):
+		'''
+		run func(*args) for future. The host's slot is given back, and the
+		next read for host let go, before the future is resolved so a poll()
+		that returns never sees the host as still busy.
+		'''
+		result = exception = None
+		try:
+			result = func(*args)
+		except Exception as e:
+			exception = e
+		with self._lock:
+			self._inflight[host] -= 1
+		self._dispatch(host)
+		if exception:
+			future.set_exception(exception)
+		else:
+			future.set_result(result)
+
+	def poll(self,jobs):
+		'''
+		jobs is a list of (host, func, args) tuples. Each func is called with
+		args on the pool. Return a list of (job, result, exception) in the
+		same order as jobs once every job is done or the cycle timeout passes.
+		Jobs not started by the timeout are dropped and jobs still running
+		are left to finish on their own; both are reported with a TimeoutError.
+		A host that still has reads running from an earlier cycle gets no
+		new ones, its jobs are reported with a TimeoutError straight away.
+		'''
+		futures = []
+		hosts = []
+		with self._lock:
+			busy = set([h for h,n in self._inflight.items() if n])
+			for job in jobs:
+				host, func, args = job
+				if host in busy:
+					futures.append(None)
+					continue
+				future = Future()
+				self._queues.setdefault(host,deque()).append((future,func,args))
+				futures.append(future)
+				if not host in hosts:
+					hosts.append(host)
+		if busy:
+			debug(f'hosts still busy from an earlier cycle: {busy}')
+		for host in hosts:
+			self._dispatch(host)
+		done, pending = wait([f for f in futures if f],timeout=self.timeout)
+		if pending:
+			debug(f'{len(pending)} reads still pending after {self.timeout}s')
+			with self._lock:
+				for host in hosts:
+					queue = self._queues.get(host)
+					while queue:
+						queue.popleft()[0].cancel()
+		results = []
+		for job, future in zip(jobs,futures):
+			if not future or not future in done:
+				results.append((job,None,TimeoutError('read did not complete')))
+			elif future.exception():
+				results.append((job,None,future.exception()))
+			else:
+				results.append((job,future.result(),None))
+		return results
+
+	def shutdown(self):
+		''' stop the pool, do not wait for outstanding reads '''
+		self._pool.shutdown(wait=False)
+
+class Scheduler(object):
+	'''
+	Priority queue of sensors keyed by (host, sensor), ordered by when each
+	is next due and then by priority (active sensors first).
+	A sensor's next read is due one interval after its last read was due.
+	If that time has already passed when the read finishes the read has 
+	overrun and the overrun policy decides what happens:
+		skip - drop the missed slots and wait for the next one on the grid
+		catchup - read again straight away until back on schedule
+		stretch - start a new grid one interval from now
+	kwargs:
+		max_backoff - longest interval in seconds for a failing host (default 60)
+		overrun - overrun policy, skip, catchup or stretch (default skip)
+	stats counts overruns and, for the skip policy, skipped reads.
+	'''
+	def __init__(self,**kwargs):
+		self.max_backoff = 60
+		self.overrun = 'skip'
+		for k,v in kwargs.items():
+			if k in ['max_backoff','overrun']:
+				setattr(self,k,v)
+			else:
+				raise ValueError(f'Invalid keyword argument {k}')
+		if not self.overrun in ['skip','catchup','stretch']:
+			raise ValueError(f'Invalid overrun policy {self.overrun}')
+		self.stats = {
+			'overruns': 0,
+			'skipped': 0
+		}
+		self._heap = []
+		self._due = {}
+		self._last_due = {}
+		self._sensors = {}
+		self._failures = {}
+		self._seq = 0
+		self.poll_interval = 1
+		self.background_interval = 10
+
+	def _push(self,key,due):
+		''' queue key at due, an older queue entry for key becomes stale '''
+		self._due[key] = due
+		self._seq += 1
+		heapq.heappush(self._heap,(due,self._sensors[key]['priority'],self._seq,key))
+
+	def update(self,plan):
+		'''
+		take sensors and intervals from a PollPlan. Sensors already known
+		keep their place, new ones are due straight away and sensors no longer
+		in the plan are dropped. A sensor that became active is due now.
+		'''
+		now = time.monotonic()
+		self.poll_interval = plan.poll_interval
+		self.background_interval = plan.background_interval
+		sensors = {}
+		for s in plan.sensors:
+			key = (s['host'],s['sensor'])
+			priority = 0 if s['active'] else 1
+			if key in sensors and sensors[key]['priority'] <= priority:
+				continue
+			sensors[key] = {'priority': priority}
+		old = self._sensors
+		self._sensors = sensors
+		for key in list(self._due):
+			if not key in sensors:
+				del self._due[key]
+		for key in sensors:
+			if not key in old or sensors[key]['priority'] < old[key]['priority']:
+				self._push(key,now)
+			elif key in self._due:
+				self._push(key,min(self._due[key],now + self._interval(key)))
+
+	def _interval(self,key):
+		''' interval for key with backoff for a failing host '''
+		if self._sensors[key]['priority'] == 0:
+			interval = self.poll_interval
+		else:
+			interval = self.background_interval
+		failures = self._failures.get(key[0],0)
+		if failures:
+			interval = min(interval * 2 ** min(failures,16),max(self.max_backoff,interval))
+		return interval
+
+	def due(self):
+		'''
+		remove and return the keys that are due, most important first. Each
+		must be handed back with done() to be scheduled again, after the
+		cycle's outcome for its host was given to host_done().
+		'''
+		now = time.monotonic()
+		keys = []
+		while self._heap and self._heap[0][0] <= now:
+			due, priority, seq, key = heapq.heappop(self._heap)
+			if self._due.get(key) != due or not key in self._sensors:
+				continue
+			del self._due[key]
+			self._last_due[key] = due
+			keys.append((priority,key))
+		keys.sort()
+		return [key for priority,key in keys]
+
+	def host_done(self,host,ok):
+		'''
+		report how host did in a cycle, ok if any of its sensors was read.
+		Call it once per host per cycle, before done() for its sensors, so
+		backoff doubles once per failed cycle however many sensors the host has.
+		'''
+		if ok:
+			self._failures.pop(host,None)
+		else:
+			self._failures[host] = self._failures.get(host,0) + 1
+
+	def done(self,key):
+		''' schedule the next read of key once it has been read '''
+		now = time.monotonic()
+		last_due = self._last_due.pop(key,now)
+		if key in self._sensors and not key in self._due:
+			interval = self._interval(key)
+			due = last_due + interval
+			if due <= now:
+				self.stats['overruns'] += 1
+				if self.overrun == 'skip':
+					missed = math.ceil((now - due) / interval)
+					if due + missed * interval <= now:
+						missed += 1
+					self.stats['skipped'] += missed
+					due += missed * interval
+				elif self.overrun == 'stretch':
+					due = now + interval
+			self._push(key,due)
+
+	def next_due(self):
+		''' monotonic time the next sensor is due, or None if nothing is queued '''
+		while self._heap:
+			due, priority, seq, key = self._heap[0]
+			if self._due.get(key) == due and key in self._sensors:
+				return due
+			heapq.heappop(self._heap)
+		return None
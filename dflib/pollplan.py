@@ -0,0 +1,71 @@
+'''
+Compile the sensors.json configuration into a poll plan for the daemon and
+reload it only when the file changes.
+'''
+import os
+import json
+
+from dflib.debug import debug
+
+class PollPlan(object):
+	'''
+	Ready to run form of the configuration: the server, poll interval and
+	background interval (for sensors without a detail window, default ten
+	times the poll interval) in seconds and a list of sensors to read, each 
+	a dict with name, host, sensor and active. Internal entries (names with 
+	::) are left out.
+	'''
+	def __init__(self,config):
+		self.server = config['server']
+		self.poll_interval = config['poll_interval']/1000
+		if 'background_interval' in config:
+			self.background_interval = config['background_interval']/1000
+		else:
+			self.background_interval = self.poll_interval * 10
+		self.sensors = []
+		for name,sensor in config['sensors'].items():
+			if '::' in name:
+				continue
+			self.sensors.append({
+				'name': name,
+				'host': sensor['host'],
+				'sensor': sensor['sensor'],
+				'active': sensor.get('active',False)
+			})
+		self.pairs = [(s['host'],s['sensor']) for s in self.sensors]
+
+class ConfigWatcher(object):
+	'''
+	Watch the configuration file and keep the last good PollPlan. The file is
+	only re-read when its modification time or size changes. A file that
+	cannot be parsed or compiled (for example one that is half written) is
+	ignored and the previous plan is kept; it is tried again on the next check.
+	'''
+	def __init__(self,path):
+		self.path = path
+		self.plan = None
+		self._signature = None
+
+	def check(self):
+		'''
+		reload the plan if the file changed. Return True if a new plan was
+		loaded, False otherwise. self.plan is always the last good plan.
+		'''
+		try:
+			st = os.stat(self.path)
+		except OSError as e:
+			debug(f'cannot stat {self.path}: {e}')
+			return False
+		signature = (st.st_mtime_ns, st.st_size)
+		if signature == self._signature:
+			return False
+		try:
+			with open(self.path) as f:
+				plan = PollPlan(json.load(f))
+		except (ValueError, KeyError, TypeError, OSError) as e:
+			debug(f'keeping previous plan, {self.path} is not usable: {e}')
+			return False
+		self._signature = signature
+		self.plan = plan
+		debug(f'loaded plan with {len(plan.sensors)} sensors')
+		return True
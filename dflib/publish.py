@@ -0,0 +1,86 @@
+'''
+Publish sensor data from the daemon to the data path.
+Each reading is encoded compactly and written to a temporary file which
+is then renamed over {host}-{sensor}.json, so readers always see either the
+old or the new file, never a partial one. A reading identical to the last
+one published for the sensor is not written at all. If a SensorStore is
+given, each changed reading is also placed in the shared memory store, if
+a PushServer is given it is pushed to subscribed clients, if a History
+is given its numeric fields are recorded and if a SensorInfo is given the
+sensor's metadata is taken from it.
+'''
+import os
+import json
+import hashlib
+import threading
+
+from dflib.debug import debug
+
+def atomic_write(path,payload):
+	'''
+	write payload (bytes) to a temporary file next to path and rename it 
+	over path
+	'''
+	tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+	try:
+		with open(tmp_path,'wb') as f:
+			f.write(payload)
+		os.replace(tmp_path,path)
+	except OSError:
+		try:
+			os.unlink(tmp_path)
+		except OSError:
+			pass
+		raise
+
+class DataPublisher(object):
+	'''
+	Write sensor readings to base_dir and, if store is set, to the shared
+	SensorStore. If push is set changed readings are sent through it, if
+	history is set they are recorded there and if info is set their metadata
+	is kept there. stats counts written and skipped readings.
+	'''
+	def __init__(self,base_dir,store=None,push=None,history=None,info=None):
+		self.base_dir = base_dir
+		self.store = store
+		self.push = push
+		self.history = history
+		self.info = info
+		self.stats = {
+			'written': 0,
+			'skipped': 0
+		}
+		self._hashes = {}
+		self._lock = threading.Lock()
+
+	def data_file(self,host,sensor):
+		''' return the path of the data file for host and sensor '''
+		return os.path.join(self.base_dir,f'{host}-{sensor}.json')
+
+	def publish(self,host,sensor,data):
+		'''
+		publish data for host and sensor. Return True if the file was
+		written, False if the reading had not changed.
+		'''
+		payload = json.dumps(data,separators=(',',':')).encode('utf-8')
+		digest = hashlib.blake2b(payload,digest_size=16).digest()
+		key = (host,sensor)
+		with self._lock:
+			if self._hashes.get(key) == digest:
+				self.stats['skipped'] += 1
+				return False
+		if self.history and type(data) is dict:
+			self.history.record(host,sensor,data)
+		if self.info and type(data) is dict:
+			self.info.update(host,sensor,data)
+		if self.store:
+			self.store.write(host,sensor,payload)
+		path = self.data_file(host,sensor)
+		atomic_write(path,payload)
+		debug("Wrote",path)
+		with self._lock:
+			self._hashes[key] = digest
+			self.stats['written'] += 1
+		if self.push:
+			self.push.publish(host,sensor,payload)
+		return True
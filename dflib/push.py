@@ -0,0 +1,383 @@
+'''
+Push channel from the daemon to the GUI over a Unix domain socket.
+
+Messages are JSON objects, one per line. A client sends
+	{"op": "subscribe", "host": host, "sensor": sensor}
+	{"op": "unsubscribe", "host": host, "sensor": sensor}
+	{"op": "history", "id": n, "host": host, "sensor": sensor,
+		"field": field, "start": time, "end": time}
+and the server sends
+	{"host": host, "sensor": sensor, "data": reading}
+whenever the reading for a subscribed sensor changes, and once straight
+after subscribing if a reading is already known. A history request is
+answered with
+	{"op": "history", "id": n, "host": host, "sensor": sensor,
+		"history": {field: [[time, value], ...]}}
+field, start and end are optional; without a field every field is returned.
+
+PushServer runs in the daemon on its own thread. PushClient is a plain
+socket wrapper; the GUI watches its fileno() on the main loop and calls
+handle_input() when it is readable.
+'''
+import os
+import json
+import socket
+import selectors
+import threading
+
+from dflib.debug import debug
+
+''' bytes queued for a client before it is considered stuck and dropped '''
+max_backlog = 1 << 20
+
+def _message(host,sensor,payload):
+	''' build a data message around an already encoded payload '''
+	head = json.dumps({'host': host, 'sensor': sensor},separators=(',',':'))
+	return head[:-1].encode('utf-8') + b',"data":' + payload + b'}\n'
+
+class _Connection(object):
+	''' server side state of one client '''
+	def __init__(self,sock):
+		self.sock = sock
+		self.inbuf = b''
+		self.outbuf = b''
+		self.subscriptions = set()
+
+class PushServer(object):
+	'''
+	Accept GUI clients on the socket at path and push changed readings
+	to the clients subscribed to them. If history (a dflib.history.History)
+	is given, history requests are answered from it.
+	'''
+	def __init__(self,path,history=None):
+		self.path = path
+		self.history = history
+		self._clients = {}
+		self._latest = {}
+		self._lock = threading.Lock()
+		self._selector = selectors.DefaultSelector()
+		self._wake_r, self._wake_w = socket.socketpair()
+		self._wake_r.setblocking(False)
+		self._wake_w.setblocking(False)
+		try:
+			os.unlink(path)
+		except FileNotFoundError:
+			pass
+		self._listener = socket.socket(socket.AF_UNIX,socket.SOCK_STREAM)
+		self._listener.bind(path)
+		self._listener.listen()
+		self._listener.setblocking(False)
+		self._selector.register(self._listener,selectors.EVENT_READ,'accept')
+		self._selector.register(self._wake_r,selectors.EVENT_READ,'wake')
+		self._thread = threading.Thread(target=self._serve,name='push',daemon=True)
+		self._thread.start()
+
+	def publish(self,host,sensor,payload):
+		'''
+		queue payload (encoded JSON bytes) for every client subscribed to
+		host and sensor. This never blocks on a client.
+		'''
+		key = (host,sensor)
+		message = _message(host,sensor,payload)
+		queued = False
+		with self._lock:
+			self._latest[key] = message
+			for conn in self._clients.values():
+				if key in conn.subscriptions:
+					conn.outbuf += message
+					queued = True
+		if queued:
+			self._wake()
+
+	def _wake(self):
+		''' nudge the server thread so it picks up new output '''
+		try:
+			self._wake_w.send(b'\0')
+		except BlockingIOError:
+			pass
+
+	def _serve(self):
+		''' server thread: accept, read requests, flush output '''
+		while True:
+			for key, events in self._selector.select():
+				if key.data == 'accept':
+					self._accept()
+				elif key.data == 'wake':
+					try:
+						while self._wake_r.recv(4096):
+							pass
+					except BlockingIOError:
+						pass
+				else:
+					conn = key.data
+					if events & selectors.EVENT_READ:
+						try:
+							self._read(conn)
+						except Exception as e:
+							''' one bad client must not take the server down '''
+							debug(f'dropping push client after error: {e}')
+							self._drop(conn)
+			self._flush()
+
+	def _accept(self):
+		''' accept a new client '''
+		try:
+			sock, addr = self._listener.accept()
+		except BlockingIOError:
+			return
+		sock.setblocking(False)
+		conn = _Connection(sock)
+		with self._lock:
+			self._clients[sock.fileno()] = conn
+		self._selector.register(sock,selectors.EVENT_READ,conn)
+		debug('push client connected')
+
+	def _drop(self,conn):
+		''' forget a client '''
+		with self._lock:
+			self._clients.pop(conn.sock.fileno(),None)
+		try:
+			self._selector.unregister(conn.sock)
+		except (KeyError, ValueError):
+			pass
+		conn.sock.close()
+		debug('push client disconnected')
+
+	def _read(self,conn):
+		''' read and act on requests from a client '''
+		try:
+			data = conn.sock.recv(4096)
+		except BlockingIOError:
+			return
+		except OSError:
+			data = b''
+		if not data:
+			self._drop(conn)
+			return
+		conn.inbuf += data
+		while b'\n' in conn.inbuf:
+			line, conn.inbuf = conn.inbuf.split(b'\n',1)
+			try:
+				self._request(conn,line)
+			except Exception as e:
+				debug(f'bad push request {line}: {e}')
+
+	def _request(self,conn,line):
+		''' check and act on one request line, raise ValueError if it is not usable '''
+		request = json.loads(line)
+		if type(request) is not dict:
+			raise ValueError('request is not an object')
+		host, sensor, op = request.get('host'), request.get('sensor'), request.get('op')
+		if type(host) is not str or type(sensor) is not str:
+			raise ValueError('host and sensor must be strings')
+		key = (host,sensor)
+		if op == 'history':
+			for k in ['start','end']:
+				v = request.get(k)
+				if v is not None and (type(v) not in [int,float] or type(v) is bool):
+					raise ValueError(f'{k} must be a number')
+			if request.get('field') is not None and type(request['field']) is not str:
+				raise ValueError('field must be a string')
+			reply = self._history_reply(request)
+			with self._lock:
+				conn.outbuf += reply
+			return
+		with self._lock:
+			if op == 'subscribe':
+				conn.subscriptions.add(key)
+				if key in self._latest:
+					conn.outbuf += self._latest[key]
+			elif op == 'unsubscribe':
+				conn.subscriptions.discard(key)
+			else:
+				raise ValueError(f'unknown op {op}')
+
+	def _history_reply(self,request):
+		''' answer a history request '''
+		host, sensor = request['host'], request['sensor']
+		start, end = request.get('start'), request.get('end')
+		result = {}
+		if self.history:
+			if request.get('field'):
+				fields = [request['field']]
+			else:
+				fields = self.history.fields(host,sensor)
+			for field in fields:
+				result[field] = self.history.query(host,sensor,field,start,end)
+		reply = {'op': 'history', 'id': request.get('id'), 'host': host, 'sensor': sensor, 'history': result}
+		return json.dumps(reply,separators=(',',':')).encode('utf-8') + b'\n'
+
+	def _flush(self):
+		''' send as much queued output as each client will take '''
+		with self._lock:
+			pending = [c for c in self._clients.values() if c.outbuf]
+		for conn in pending:
+			with self._lock:
+				out = conn.outbuf
+			if len(out) > max_backlog:
+				debug('push client is not reading, dropping it')
+				self._drop(conn)
+				continue
+			try:
+				sent = conn.sock.send(out)
+			except BlockingIOError:
+				sent = 0
+			except OSError:
+				self._drop(conn)
+				continue
+			with self._lock:
+				conn.outbuf = conn.outbuf[sent:]
+				events = selectors.EVENT_READ | (selectors.EVENT_WRITE if conn.outbuf else 0)
+			if conn.sock.fileno() >= 0:
+				self._selector.modify(conn.sock,events,conn)
+
+class PushClient(object):
+	'''
+	Client end of the push channel. subscribe() registers a callback for
+	a host and sensor; the callback receives each reading pushed for it.
+	Subscriptions are kept across reconnects.
+	'''
+	def __init__(self,path):
+		self.path = path
+		self.sock = None
+		self._inbuf = b''
+		self._callbacks = {}
+		self._requests = {}
+		self._next_id = 1
+
+	@property
+	def connected(self):
+		return self.sock is not None
+
+	def connect(self):
+		''' connect to the daemon, return True if connected '''
+		if self.sock:
+			return True
+		sock = socket.socket(socket.AF_UNIX,socket.SOCK_STREAM)
+		try:
+			sock.connect(self.path)
+		except OSError as e:
+			debug(f'cannot connect to {self.path}: {e}')
+			sock.close()
+			return False
+		sock.setblocking(False)
+		self.sock = sock
+		self._inbuf = b''
+		for host, sensor in self._callbacks:
+			self._send('subscribe',host,sensor)
+		return True
+
+	def close(self):
+		''' drop the connection, subscriptions are kept '''
+		if self.sock:
+			self.sock.close()
+			self.sock = None
+
+	def fileno(self):
+		return self.sock.fileno() if self.sock else -1
+
+	def _send(self,op,host,sensor,**kwargs):
+		''' send a request, return False if the daemon has gone '''
+		if not self.sock:
+			return False
+		request = {'op': op, 'host': host, 'sensor': sensor}
+		request.update(kwargs)
+		line = json.dumps(request) + '\n'
+		try:
+			self.sock.sendall(line.encode('utf-8'))
+		except OSError as e:
+			debug(f'push send failed: {e}')
+			self.close()
+			return False
+		return True
+
+	def history(self,host,sensor,callback,field=None,start=None,end=None):
+		'''
+		ask the daemon for history of host/sensor. callback receives a dict
+		of field: [[time, value], ...] when the answer arrives. Return
+		False if the request could not be sent.
+		'''
+		request_id = self._next_id
+		self._next_id += 1
+		if not self._send('history',host,sensor,id=request_id,field=field,start=start,end=end):
+			return False
+		self._requests[request_id] = callback
+		return True
+
+	def subscribe(self,host,sensor,callback):
+		''' call callback(data) whenever host/sensor changes '''
+		key = (host,sensor)
+		if not key in self._callbacks:
+			self._callbacks[key] = []
+			self._send('subscribe',host,sensor)
+		self._callbacks[key].append(callback)
+
+	def unsubscribe(self,host,sensor,callback):
+		''' stop calling callback for host/sensor '''
+		key = (host,sensor)
+		if key in self._callbacks and callback in self._callbacks[key]:
+			self._callbacks[key].remove(callback)
+			if not self._callbacks[key]:
+				del self._callbacks[key]
+				self._send('unsubscribe',host,sensor)
+
+	def handle_input(self):
+		'''
+		read and dispatch whatever the daemon sent. Return False if the
+		connection was lost.
+		'''
+		if not self.sock:
+			return False
+		try:
+			while True:
+				data = self.sock.recv(65536)
+				if not data:
+					self.close()
+					return False
+				self._inbuf += data
+		except BlockingIOError:
+			pass
+		except OSError as e:
+			debug(f'push receive failed: {e}')
+			self.close()
+			return False
+		while b'\n' in self._inbuf:
+			line, self._inbuf = self._inbuf.split(b'\n',1)
+			try:
+				message = json.loads(line)
+				key = (message['host'],message['sensor'])
+			except (ValueError, KeyError, TypeError) as e:
+				debug(f'bad push message: {e}')
+				continue
+			if message.get('op') == 'history':
+				callback = self._requests.pop(message.get('id'),None)
+				if callable(callback):
+					callback(message['history'])
+				continue
+			for callback in list(self._callbacks.get(key,[])):
+				callback(message['data'])
+		return True
+
+def query_history(path,host,sensor,field=None,start=None,end=None,timeout=2):
+	'''
+	blocking history query for local tools that do not run a main loop.
+	Return a dict of field: [[time, value], ...] or None if the daemon
+	could not be asked.
+	'''
+	request = {'op': 'history', 'id': 0, 'host': host, 'sensor': sensor,
+		'field': field, 'start': start, 'end': end}
+	try:
+		with socket.socket(socket.AF_UNIX,socket.SOCK_STREAM) as sock:
+			sock.settimeout(timeout)
+			sock.connect(path)
+			sock.sendall(json.dumps(request).encode('utf-8') + b'\n')
+			data = b''
+			while not b'\n' in data:
+				chunk = sock.recv(65536)
+				if not chunk:
+					return None
+				data += chunk
+	except OSError as e:
+		debug(f'history query failed: {e}')
+		return None
+	return json.loads(data.split(b'\n',1)[0])['history']
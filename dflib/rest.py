@@ -1,24 +1,238 @@
 import os
 import sys
+import json
+import time
+import threading
+import socket
 import requests
-import subprocess
 import pprint
-
-def _ping(host='8.8.8.8'):
-   try:
-      subprocess.check_output(["ping", "-c", "1", host])
-      return True
-   except subprocess.CalledProcessError:
-      return False
+from requests.adapters import HTTPAdapter
+from dflib.debug import debug
 
 stats = {
 	'sent': 0,
 	'errors': 0
 }
 
+''' port the SensorFS RestAPI listens on '''
+api_port = 4242
+
+''' Keep-alive connection pools, one requests.Session per API server '''
+pool_options = {
+	'pool_size': 10,		# connections kept open per server
+	'idle_expiry': 60		# seconds an unused session is kept
+}
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+def set_pool_options(**kwargs):
+	'''
+	set pool_size and/or idle_expiry for the shared sessions. Existing
+	sessions are closed so the new pool size takes effect.
+	'''
+	for k,v in kwargs.items():
+		if not k in pool_options:
+			raise ValueError(f'Invalid keyword argument {k}')
+		pool_options[k] = v
+	close_sessions()
+
+def _get_session(server):
+	'''
+	return the shared session for server, creating it if needed. Sessions
+	that have not been used for idle_expiry seconds are closed first.
+	'''
+	now = time.monotonic()
+	with _sessions_lock:
+		for name in list(_sessions):
+			session, last_used = _sessions[name]
+			if now - last_used > pool_options['idle_expiry']:
+				session.close()
+				del _sessions[name]
+		if server in _sessions:
+			session = _sessions[server][0]
+		else:
+			session = requests.Session()
+			adapter = HTTPAdapter(pool_connections=1,pool_maxsize=pool_options['pool_size'])
+			session.mount('http://',adapter)
+			session.headers.update({'Accept': 'application/json'})
+		_sessions[server] = (session, now)
+		return session
+
+def close_sessions():
+	''' close every shared session '''
+	with _sessions_lock:
+		for session, last_used in _sessions.values():
+			session.close()
+		_sessions.clear()
+
+class Reachability(object):
+	'''
+	Track whether each API server is up or down. State is set by the outcome
+	of real requests (mark_up/mark_down). A server marked down is not tried
+	again until a background TCP probe of port finds it answering; a new probe
+	is started at most once every ttl seconds. Unknown servers are assumed up.
+	kwargs:
+		port - port to probe (default api_port)
+		ttl - seconds a down state is trusted before probing again (default 5)
+		timeout - probe connect timeout in seconds (default 1)
+	'''
+	def __init__(self,**kwargs):
+		self.port = None
+		self.ttl = 5
+		self.timeout = 1
+		for k,v in kwargs.items():
+			if k in ['port','ttl','timeout']:
+				setattr(self,k,v)
+			else:
+				raise ValueError(f'Invalid keyword argument {k}')
+		self._state = {}
+		self._probing = set()
+		self._lock = threading.Lock()
+
+	def is_up(self,server):
+		'''
+		return the cached state of server. This never blocks; when a down
+		state is older than ttl a probe is started in the background.
+		'''
+		with self._lock:
+			if not server in self._state:
+				return True
+			up, when = self._state[server]
+			if up:
+				return True
+			if time.monotonic() - when < self.ttl or server in self._probing:
+				return False
+			self._probing.add(server)
+		threading.Thread(target=self._probe,args=(server,),daemon=True).start()
+		return False
+
+	def mark_up(self,server):
+		''' record that server answered '''
+		with self._lock:
+			self._state[server] = (True, time.monotonic())
+
+	def mark_down(self,server):
+		''' record that server could not be reached '''
+		with self._lock:
+			self._state[server] = (False, time.monotonic())
+
+	def _probe(self,server):
+		''' try a TCP connect to server and record the result '''
+		try:
+			port = self.port or api_port
+			with socket.create_connection((server,port),timeout=self.timeout):
+				pass
+			self.mark_up(server)
+		except OSError:
+			self.mark_down(server)
+		finally:
+			with self._lock:
+				self._probing.discard(server)
+
+reachability = Reachability()
+
+class DiscoveryCache(object):
+	'''
+	Cache of discovery answers (hosts and list) per server. Entries expire
+	after ttl seconds and can be dropped with invalidate(). If a snapshot
+	path is given with open(), the cache is loaded from it and rewritten
+	whenever an entry is added, so it survives restarts.
+	kwargs:
+		ttl - seconds an answer is trusted (default 3600)
+	'''
+	def __init__(self,**kwargs):
+		self.ttl = 3600
+		for k,v in kwargs.items():
+			if k in ['ttl']:
+				setattr(self,k,v)
+			else:
+				raise ValueError(f'Invalid keyword argument {k}')
+		self.path = None
+		self._entries = {}
+		self._lock = threading.Lock()
+
+	def open(self,path):
+		''' use path as the on-disk snapshot, loading it if it exists '''
+		self.path = path
+		try:
+			with open(path) as f:
+				entries = json.load(f)
+		except (OSError, ValueError) as e:
+			debug(f'no discovery snapshot loaded from {path}: {e}')
+			return
+		with self._lock:
+			for entry in entries:
+				server, command, when, value = entry
+				self._entries[(server,command)] = (when,value)
+
+	def _save(self):
+		''' rewrite the snapshot, called with the lock held '''
+		if not self.path:
+			return
+		entries = [[k[0],k[1],when,value] for k,(when,value) in self._entries.items()]
+		tmp_path = f'{self.path}.tmp'
+		try:
+			with open(tmp_path,'w') as f:
+				json.dump(entries,f)
+			os.replace(tmp_path,self.path)
+		except OSError as e:
+			debug(f'cannot save discovery snapshot: {e}')
+
+	def get(self,server,command):
+		''' return a copy of the cached answer or None if missing or expired '''
+		with self._lock:
+			entry = self._entries.get((server,command))
+			if not entry or time.time() - entry[0] > self.ttl:
+				return None
+			return list(entry[1])
+
+	def put(self,server,command,value):
+		''' cache an answer '''
+		with self._lock:
+			self._entries[(server,command)] = (time.time(),list(value))
+			self._save()
+
+	def invalidate(self,server=None,command=None):
+		''' drop cached answers, for a server or a single command, or all of them '''
+		with self._lock:
+			for key in list(self._entries):
+				if server is None or (key[0] == server and command in (None,key[1])):
+					del self._entries[key]
+			self._save()
+
+discovery = DiscoveryCache()
+
+''' Whether each API server understands read_many: True, False or missing (unknown) '''
+_batch_support = {}
+
+def batch_supported(server):
+	'''
+	return True if server is known to answer batched reads, False if it is
+	known not to and None if it has not been tried yet.
+	'''
+	return _batch_support.get(server)
+
+'''
+observer, if set, is called after every request as
+	observer(server, command, seconds, bytes, error_kind)
+error_kind is None on success or one of unreachable, timeout, connection,
+request, server or decode.
+'''
+observer = None
+
+def _observe(server,command,seconds,nbytes,kind):
+	''' report a request to the observer, never letting it break the request '''
+	if callable(observer):
+		try:
+			observer(server,command,seconds,nbytes,kind)
+		except Exception as e:
+			debug(f'observer failed: {e}')
+
 class RestClient(object):
 	'''
 	This is the improved RESTapi interface as an class.
+	server, host and sensor must be given, timeout (seconds per request,
+	default 10) is optional.
 	'''
 	def __init__(self,**kwargs):
 		'''
@@ -26,6 +240,7 @@ class RestClient(object):
 		self.server = None
 		self.host = None
 		self.sensor = None
+		self.timeout = 10
 
 		for k in ['server','host','sensor']:
 			if not k in kwargs:
@@ -39,10 +254,10 @@ class RestClient(object):
 
 	def setup(self,**kwargs):
 		'''
-		set new options in kwargs for server, host and sensor. Any or all
-		may be specified.
+		set new options in kwargs for server, host, sensor and timeout. Any 
+		or all may be specified.
 		'''
-		for k in ['server','host','sensor']:
+		for k in ['server','host','sensor','timeout']:
 			if k in kwargs:
 				setattr(self,k,kwargs[k])
 
@@ -63,24 +278,47 @@ class RestClient(object):
 		Send a formatted command to the server, return the response, or
 		return None on error. detailedError is called on exceptions.
 		command contains the url encoded command and parameters. These are sent
-		to server on port 4242.
+		to server on api_port over the shared keep-alive session for the server.
 		"""
-		if not _ping(self.server):
+		if not reachability.is_up(self.server):
 			stats['errors'] += 1
+			_observe(self.server,command,0,0,'unreachable')
 			return {'error': 'host unreachable'}
-		headers = {'Accept': 'application/json'}
-		url = f'http://{self.server}:4242/{command}'
+		url = f'http://{self.server}:{api_port}/{command}'
+		started = time.monotonic()
+		try:
+			r = _get_session(self.server).get(url=url, timeout=self.timeout)
+		except requests.Timeout as e:
+			''' a slow answer may just be a slow sensor host, only a failed connect means the server is down '''
+			if isinstance(e,requests.ConnectTimeout):
+				reachability.mark_down(self.server)
+			stats['errors'] += 1
+			_observe(self.server,command,time.monotonic()-started,0,'timeout')
+			return {'error': e}
+		except requests.ConnectionError as e:
+			reachability.mark_down(self.server)
+			stats['errors'] += 1
+			_observe(self.server,command,time.monotonic()-started,0,'connection')
+			return {'error': e}
+		except Exception as e:
+			stats['errors'] += 1
+			_observe(self.server,command,time.monotonic()-started,0,'request')
+			return {'error': e}
+		elapsed = time.monotonic() - started
+		reachability.mark_up(self.server)
 		try:
-			r = requests.get(url=url, headers=headers,timeout=10)
 			stats['sent'] += 1
 			js = r.json()
 			if 'error' in js:
 				stats['errors'] += 1
+				_observe(self.server,command,elapsed,len(r.content),'server')
 				return js
 		except Exception as e:
 			stats['errors'] += 1
+			_observe(self.server,command,elapsed,len(r.content),'decode')
 			return {'error': e}
-		return r.json()
+		_observe(self.server,command,elapsed,len(r.content),None)
+		return js
 
 
 	def read(self):
@@ -89,20 +327,76 @@ class RestClient(object):
 		"""
 		return self._sendCommand(f'read?host={self.host}&sensor={self.sensor}')
 
+	def read_many(self,pairs):
+		"""
+		get sensor data for a list of (host, sensor) pairs from the server.
+		Where the server supports it this is a single read_many request,
+		otherwise each pair is read in turn over the server's keep-alive
+		connection. A list of json objects is returned in the order of pairs.
+		"""
+		pairs = list(pairs)
+		if not pairs:
+			return []
+		if _batch_support.get(self.server) is not False:
+			keys = [f'{host}:{sensor}' for host, sensor in pairs]
+			reply = self._sendCommand(f'read_many?sensors={",".join(keys)}')
+			if type(reply) is dict and not 'error' in reply:
+				_batch_support[self.server] = True
+				return [reply.get(k,{'error': 'no data'}) for k in keys]
+			if type(reply) is dict and 'error' in reply:
+				e = reply['error']
+				if e == 'host unreachable' or isinstance(e,(requests.ConnectionError,requests.Timeout)):
+					''' the request failed, this says nothing about batch support '''
+					return [reply for k in keys]
+			debug(f'{self.server} does not support read_many: {reply}')
+			_batch_support[self.server] = False
+		results = []
+		for host, sensor in pairs:
+			results.append(self._sendCommand(f'read?host={host}&sensor={sensor}'))
+		return results
+
 	def write(self,data):
 		"""
 		write sensor data to host as json object
 		"""
 		return self._sendCommand(f'write?host={self.host}&sensor={self.sensor}&data={str(data)}')
 
-	def list(self):
+	def _discover(self,command,refresh):
+		"""
+		send a discovery command, answering from the discovery cache when
+		possible. Only successful, non empty (list) answers are cached.
+		"""
+		if not refresh:
+			cached = discovery.get(self.server,command)
+			if cached is not None:
+				return cached
+		result = self._sendCommand(command)
+		if type(result) is list and result:
+			discovery.put(self.server,command,result)
+		return result
+
+	def list(self,refresh=False):
+		"""
+		get list of sensors on host, from the discovery cache unless refresh is set
+		"""
+		return self._discover(f'list?host={self.host}',refresh)
+
+	def hosts(self,refresh=False):
+		"""
+		get a list of hosts the server knows about, from the discovery cache
+		unless refresh is set
+		"""
+		return self._discover('hosts',refresh)
+
+	def cached_list(self):
 		"""
-		get list of sensors on host
+		the cached list of sensors on host, None if there is none. Never
+		uses the network.
 		"""
-		return self._sendCommand(f'list?host={self.host}')
+		return discovery.get(self.server,f'list?host={self.host}')
 
-	def hosts(self):
+	def cached_hosts(self):
 		"""
-		get a list of hosts the server knows about
+		the cached list of hosts, None if there is none. Never uses the network.
 		"""
-		return self._sendCommand('hosts')
+		return discovery.get(self.server,'hosts')
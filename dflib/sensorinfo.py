@@ -0,0 +1,76 @@
+'''
+Sensor metadata (module, description and so on) captured by the daemon from
+the readings it collects and kept in sensorinfo.json on the data path. The
+GUI looks sensors up in the file instead of asking the RestAPI server; the
+file is only re-read when it changes so a lookup is a dict access.
+'''
+import os
+import json
+import threading
+
+from dflib.debug import debug
+from dflib.publish import atomic_write
+
+''' fields of a reading that describe the sensor rather than measure anything '''
+info_fields = ['name', 'description', 'modinfo']
+
+class SensorInfo(object):
+	'''
+	Metadata for every sensor seen, keyed by host and sensor.
+	The daemon calls update() with each reading and write() to save the file
+	when something changed. The GUI calls lookup(), which reloads the file
+	if its modification time or size changed.
+	'''
+	def __init__(self,path):
+		self.path = path
+		self.dirty = False
+		self._info = {}
+		self._signature = None
+		self._lock = threading.Lock()
+
+	def update(self,host,sensor,data):
+		''' take the metadata fields from a reading of host and sensor '''
+		info = {k: data[k] for k in info_fields if k in data}
+		if not info:
+			return
+		key = f'{host}-{sensor}'
+		with self._lock:
+			if self._info.get(key) != info:
+				self._info[key] = info
+				self.dirty = True
+
+	def write(self):
+		''' rewrite the file if the metadata changed since the last write '''
+		with self._lock:
+			if not self.dirty:
+				return False
+			payload = json.dumps(self._info,indent=2).encode('utf-8')
+			self.dirty = False
+		atomic_write(self.path,payload)
+		debug("Wrote",self.path)
+		return True
+
+	def load(self):
+		''' re-read the file if it changed, keep what we have if it is not usable '''
+		try:
+			st = os.stat(self.path)
+		except OSError:
+			return
+		signature = (st.st_mtime_ns, st.st_size)
+		if signature == self._signature:
+			return
+		try:
+			with open(self.path) as f:
+				info = json.load(f)
+		except (OSError, ValueError) as e:
+			debug(f'cannot load {self.path}: {e}')
+			return
+		self._signature = signature
+		with self._lock:
+			self._info = info
+
+	def lookup(self,host,sensor):
+		''' return the metadata dict for host and sensor, empty if not known '''
+		self.load()
+		with self._lock:
+			return dict(self._info.get(f'{host}-{sensor}',{}))
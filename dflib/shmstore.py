@@ -0,0 +1,196 @@
+'''
+Memory mapped sensor store shared between the daemon and the GUI.
+
+The store is a file on the data path, mapped into both processes. It holds
+a header and a fixed number of fixed size slots, one per host/sensor. Each
+slot is guarded by a sequence counter (a seqlock): the writer makes it odd
+before changing the slot and even again afterwards, so a reader that sees
+the same even value before and after copying the payload knows the copy is
+whole. Readers keep the last decoded reading per slot and only copy and
+parse the payload when the counter has moved.
+
+Layout:
+	header: magic (8s), version, slot count, slot size (3 x uint32)
+	slot: key (64s), sequence (uint64), payload length (uint32), pad, payload
+'''
+import os
+import json
+import mmap
+import struct
+import zlib
+import threading
+
+from dflib.debug import debug
+
+MAGIC = b'SENSHM01'
+VERSION = 1
+HEADER = struct.Struct('<8sIII')
+HEADER_SIZE = 64
+SLOT_HEADER = struct.Struct('<64sQII')
+SEQ = struct.Struct('<Q')
+SEQ_OFFSET = 64
+LENGTH = struct.Struct('<I')
+LENGTH_OFFSET = 72
+
+class SensorStore(object):
+	'''
+	Open (and for the writer, create) the store at path.
+	kwargs:
+		writer - True in the daemon, False (default) in readers
+		slots - number of slots when creating the store (default 128)
+		slot_size - bytes per slot including its header (default 4096)
+	A reader whose store file does not exist yet gets a store that is not
+	open; reads return None until the file appears.
+	'''
+	def __init__(self,path,**kwargs):
+		self.path = path
+		self.writer = False
+		self.slots = 128
+		self.slot_size = 4096
+		for k,v in kwargs.items():
+			if k in ['writer','slots','slot_size']:
+				setattr(self,k,v)
+			else:
+				raise ValueError(f'Invalid keyword argument {k}')
+		self._mm = None
+		self._offsets = {}
+		self._cache = {}
+		self._lock = threading.Lock()
+		self.open()
+
+	def open(self):
+		''' map the store file, return True if it is open '''
+		if self._mm:
+			return True
+		size = HEADER_SIZE + self.slots * self.slot_size
+		if self.writer:
+			fd = os.open(self.path,os.O_RDWR | os.O_CREAT,0o644)
+			try:
+				if not self._valid_header(fd):
+					os.ftruncate(fd,0)
+					os.ftruncate(fd,size)
+					os.pwrite(fd,HEADER.pack(MAGIC,VERSION,self.slots,self.slot_size),0)
+				self._mm = mmap.mmap(fd,0)
+			finally:
+				os.close(fd)
+		else:
+			try:
+				fd = os.open(self.path,os.O_RDONLY)
+			except FileNotFoundError:
+				return False
+			try:
+				if not self._valid_header(fd):
+					return False
+				self._mm = mmap.mmap(fd,0,access=mmap.ACCESS_READ)
+			finally:
+				os.close(fd)
+		magic, version, self.slots, self.slot_size = HEADER.unpack_from(self._mm,0)
+		return True
+
+	def _valid_header(self,fd):
+		''' check the header of an existing file, for the writer it must match our geometry '''
+		data = os.pread(fd,HEADER.size,0)
+		if len(data) < HEADER.size:
+			return False
+		magic, version, slots, slot_size = HEADER.unpack(data)
+		if magic != MAGIC or version != VERSION:
+			return False
+		if self.writer:
+			return slots == self.slots and slot_size == self.slot_size
+		return os.fstat(fd).st_size >= HEADER_SIZE + slots * slot_size
+
+	def close(self):
+		''' unmap the store '''
+		if self._mm:
+			self._mm.close()
+			self._mm = None
+		self._offsets = {}
+		self._cache = {}
+
+	def _find_slot(self,key,claim=False):
+		'''
+		find the slot offset for key by open addressing. When claim is set an
+		empty slot is taken for a new key. Return None if there is no slot.
+		'''
+		if key in self._offsets:
+			return self._offsets[key]
+		bkey = key.encode('utf-8')[:64]
+		start = zlib.crc32(bkey) % self.slots
+		for i in range(self.slots):
+			offset = HEADER_SIZE + ((start + i) % self.slots) * self.slot_size
+			slot_key = bytes(self._mm[offset:offset+64]).rstrip(b'\0')
+			if slot_key == bkey:
+				self._offsets[key] = offset
+				return offset
+			if not slot_key:
+				if not claim:
+					return None
+				self._mm[offset:offset+64] = bkey.ljust(64,b'\0')
+				self._offsets[key] = offset
+				return offset
+		return None
+
+	def write(self,host,sensor,payload):
+		'''
+		store payload (bytes) for host and sensor. Return False if it
+		does not fit in a slot or the store is full, in which case the
+		slot, if any, is emptied so readers fall back to the data file.
+		'''
+		key = f'{host}-{sensor}'
+		with self._lock:
+			offset = self._find_slot(key,claim=True)
+			if offset is None:
+				debug(f'no slot for {key}')
+				return False
+			fits = len(payload) <= self.slot_size - SLOT_HEADER.size
+			seq, = SEQ.unpack_from(self._mm,offset+SEQ_OFFSET)
+			''' a writer that died mid write leaves the counter odd, move on to the next even one '''
+			seq = (seq + 1) & ~1
+			SEQ.pack_into(self._mm,offset+SEQ_OFFSET,seq+1)
+			if fits:
+				start = offset + SLOT_HEADER.size
+				self._mm[start:start+len(payload)] = payload
+				LENGTH.pack_into(self._mm,offset+LENGTH_OFFSET,len(payload))
+			else:
+				LENGTH.pack_into(self._mm,offset+LENGTH_OFFSET,0)
+			SEQ.pack_into(self._mm,offset+SEQ_OFFSET,seq+2)
+			return fits
+
+	def read(self,host,sensor):
+		'''
+		return the decoded reading for host and sensor, or None if the store
+		has none. If the slot has not changed since the last read the cached
+		object is returned without copying or parsing.
+		'''
+		if not self._mm and not self.open():
+			return None
+		key = f'{host}-{sensor}'
+		offset = self._find_slot(key)
+		if offset is None:
+			return None
+		cached = self._cache.get(key)
+		for tries in range(100):
+			seq, = SEQ.unpack_from(self._mm,offset+SEQ_OFFSET)
+			if cached and cached[0] == seq:
+				return cached[1]
+			if seq & 1:
+				continue
+			length, = LENGTH.unpack_from(self._mm,offset+LENGTH_OFFSET)
+			start = offset + SLOT_HEADER.size
+			payload = self._mm[start:start+length]
+			if SEQ.unpack_from(self._mm,offset+SEQ_OFFSET)[0] != seq:
+				continue
+			data = json.loads(payload) if length else None
+			self._cache[key] = (seq, data)
+			return data
+		debug(f'{key} kept changing while being read')
+		return cached[1] if cached else None
+
+	def generation(self,host,sensor):
+		''' return the sequence counter for host and sensor, or None '''
+		if not self._mm and not self.open():
+			return None
+		offset = self._find_slot(f'{host}-{sensor}')
+		if offset is None:
+			return None
+		return SEQ.unpack_from(self._mm,offset+SEQ_OFFSET)[0]
@@ -10,6 +10,7 @@ Included are:
 	yesno - a simple Gtk.Dialog function to ask a yesno question 
 	and return the result
 	MenuBar - a MenuBar that builds menus from a dictionary
+	css_provider - a shared Gtk.CssProvider for a piece of css
 '''	
 
 
@@ -40,20 +41,40 @@ def yesno(parent,message):
 	else:
 		return 'no'
 
-def _widget_set_css(widget, classname, css_data):
+''' providers by css text, each piece of css is parsed once '''
+_css_providers = {}
+
+def css_provider(css_data):
 	'''
-	this function takes an arbitrary widget and applies the classname as it's class
-	the css_data is applied to the widget.
+	return the Gtk.CssProvider for css_data, creating it on first use. 
+	Every widget styled with the same css shares one provider.
 	'''
 	if type(css_data) is str:
 		css_data = bytes(css_data.encode('ascii'))
 	if type(css_data) is not bytes:
 		raise TypeError(f'{type(css_data)} is not appropriate for css_data')
-	css_provider = Gtk.CssProvider()
-	css_provider.load_from_data(css_data)
+	if not css_data in _css_providers:
+		provider = Gtk.CssProvider()
+		provider.load_from_data(css_data)
+		_css_providers[css_data] = provider
+	return _css_providers[css_data]
+
+def _widget_set_css(widget, classname, css_data):
+	'''
+	this function takes an arbitrary widget and applies the classname as it's class
+	the css_data is applied to the widget. A widget carries one provider from
+	here at a time: the same css again does nothing, other css replaces it.
+	'''
+	provider = css_provider(css_data)
+	current = getattr(widget,'_css_provider',None)
+	if current is provider:
+		return
 	context = widget.get_style_context()
+	if current:
+		context.remove_provider(current)
 	context.add_class(classname)
-	context.add_provider(css_provider,Gtk.STYLE_PROVIDER_PRIORITY_APPLICATION)
+	context.add_provider(provider,Gtk.STYLE_PROVIDER_PRIORITY_APPLICATION)
+	widget._css_provider = provider
 
 
 class MessageDialog(Gtk.Window):
@@ -238,11 +259,11 @@ class Toggle(Gtk.Box):
 
 	def label_set_css(self,classname, css_data):
 		if not self._button_images:
-			_widget_set_css(self,self.label,classname, css_data)
+			_widget_set_css(self.label,classname, css_data)
 
 	def button_set_css(self,classname, css_data):
 		if not self._button_images:
-			_widget_set_css(self,self.button,classname, css_data)
+			_widget_set_css(self.button,classname, css_data)
 
 	def change_button(self):
 		getattr(self,'button')
@@ -294,6 +315,8 @@ class ListBox(Gtk.ListBox):
 			else:
 				raise ValueError(f'{k} is not a valid keyword argument')
 		super().__init__()
+		self.connect('row-selected',self.on_row_selected)
+		self.connect('row-activated',self.on_row_activated)
 		self.populate(self.items)
 
 	def select_row_by_label(self,text):
@@ -325,8 +348,6 @@ class ListBox(Gtk.ListBox):
 			self.add(Gtk.Label(label=i))
 
 		self.show_all()
-		self.connect('row-selected',self.on_row_selected)
-		self.connect('row-activated',self.on_row_activated)
 
 	def on_row_activated(self, widget, selected):
 		'''
@@ -410,21 +431,13 @@ class LabeledEntry(Gtk.Box):
 		return self.label.set_text(text)
 
 	def _widget_set_css(self, widget, classname, css_data):
-		if type(css_data) is str:
-			css_data = bytes(css_data.decode('ascii'))
-		if type(css_data) is not bytes:
-			raise TypeError(f'{type(css_data)} is not appropriate for css_data')
-		css_provider = Gtk.CssProvider()
-		css_provider.load_from_data(css_data)
-		context = widget.get_style_context()
-		context.add_class(classname)
-		context.add_provider(css_provider,Gtk.STYLE_PROVIDER_PRIORITY_APPLICATION)
+		_widget_set_css(widget, classname, css_data)
 
 	def label_set_css(self,classname, css_data):
-		_widget_set_css(self,self.label,classname, css_data)
+		_widget_set_css(self.label,classname, css_data)
 
 	def entry_set_css(self,classname, css_data):
-		_widget_set_css(self,self.entry,classname, css_data)
+		_widget_set_css(self.entry,classname, css_data)
 
 
 class Button(Gtk.Button):
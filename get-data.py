@@ -1,7 +1,6 @@
 #!/usr/bin/env python3
 import sys
 import os
-import json
 import time
 import argparse
 import psutil
@@ -11,8 +10,25 @@ sys.path.append(prog_dir)
 os.chdir(prog_dir)
 from dflib import rest
 from dflib.debug import *
+from dflib.poller import Poller, Scheduler
+from dflib.pollplan import ConfigWatcher
+from dflib.publish import DataPublisher
+from dflib.shmstore import SensorStore
+from dflib.push import PushServer
+from dflib.history import History
+from dflib.metrics import Metrics
+from dflib.sensorinfo import SensorInfo
 pid_file = '/tmp/get-data.pid'
+push_socket = '/tmp/get-data.sock'
 data_path = '/Volumes/RamDisk/sensordata'
+poll_workers = 16
+poll_per_host = 2
+overrun_policy = 'skip'
+store_file = 'sensors.shm'
+history_size = 3600
+metrics_file = 'metrics.json'
+metrics_interval = 10
+info_file = 'sensorinfo.json'
 
 def is_running():
 	'''
@@ -67,55 +83,116 @@ def log(*args):
 		print(f'{tstr}:',*args,file=f)
 		debug(*args)
 
-def get_config():
+def read_pairs(server,pairs,publisher,metrics):
 	'''
-	read common config file 
+	read the (host, sensor) pairs from server and publish their data to 
+	{base_dir}/{host}-{sensor}.json. Return the list of readings.
 	'''
-	try:
-		with open('sensors.json') as f:
-			return  json.load(f)
-	except:
-		return None
+	client = rest.RestClient(server=server,host='none',sensor='none')
+	started = time.monotonic()
+	results = client.read_many(pairs)
+	elapsed = time.monotonic() - started
+	hosts = {}
+	for (host,sen),sensor_data in zip(pairs,results):
+		sensors, errors = hosts.get(host,(0,0))
+		if type(sensor_data) is dict and not 'error' in sensor_data:
+			publisher.publish(host,sen,sensor_data)
+		else:
+			errors += 1
+		hosts[host] = (sensors + 1, errors)
+	if len(pairs) == 1:
+		metrics.read(pairs[0][0],pairs[0][1],elapsed)
+	else:
+		metrics.batch(len(pairs),elapsed,hosts)
+	return results
+
+def collect(poller,server,pairs,publisher,metrics):
+	'''
+	read pairs in one batched request to the server, or, if the server
+	does not support that, concurrently. Return a list of ((host, sensor), ok)
+	'''
+	if rest.batch_supported(server) is False:
+		jobs = [(pair[0],read_pairs,(server,[pair],publisher,metrics)) for pair in pairs]
+	else:
+		jobs = [(server,read_pairs,(server,pairs,publisher,metrics))]
+	outcome = []
+	for job,results,e in poller.poll(jobs):
+		job_pairs = job[2][1]
+		if e:
+			log(f'Exception getting data for {job[0]}: {e}')
+			outcome.extend([(pair,False) for pair in job_pairs])
+			continue
+		for pair,sensor_data in zip(job_pairs,results):
+			outcome.append((pair,type(sensor_data) is dict and not 'error' in sensor_data))
+	return outcome
+
 def main(base_dir):
 	'''
-	loop through defined sensors and write data to {base_dir}/{host}-{sensor}.json
-	sleep for poll interval miliseconds
+	read due sensors and write data to {base_dir}/{host}-{sensor}.json
+	sensors.json is only re-read when it changes. files are replaced atomically
+	and only when the reading has changed.
+	active sensors (those with a detail window) are read every poll interval,
+	others every background interval and sensors on failing hosts back off.
+	intervals are kept at a fixed rate, reads that overrun follow overrun_policy.
 	'''
-	config = None
-	while not config:
-		config = get_config()
-		if not config:
-			time.sleep(1)
-	poll_interval = config['poll_interval']/1000
+	watcher = ConfigWatcher('sensors.json')
+	while not watcher.check():
+		time.sleep(1)
+	rest.set_pool_options(pool_size=poll_workers)
+	poller = Poller(workers=poll_workers,per_host=poll_per_host)
+	scheduler = Scheduler(overrun=overrun_policy)
+	scheduler.update(watcher.plan)
+	store = SensorStore(os.path.join(base_dir,store_file),writer=True)
+	history = History(capacity=history_size)
+	push = PushServer(push_socket,history)
+	info = SensorInfo(os.path.join(base_dir,info_file))
+	info.load()
+	publisher = DataPublisher(base_dir,store,push,history,info)
+	metrics = Metrics()
+	metrics.sources = {
+		'writes': lambda: publisher.stats,
+		'scheduler': lambda: scheduler.stats,
+		'rest': lambda: rest.stats
+	}
+	rest.observer = metrics.request
+	metrics_path = os.path.join(base_dir,metrics_file)
+	metrics_due = time.monotonic() + metrics_interval
 	while True:
-		time.sleep(poll_interval)
-		config = get_config()
-		if not config:
-			continue
-		poll_interval = config['poll_interval']/1000
-		for name,sensor in config['sensors'].items():
-			if '::' in name:
-				continue
-			#if not sensor['active']:
-			#	continue
-			host = sensor['host']
-			sen = sensor['sensor']
-			server = config['server']
-			debug(server,host,sensor)
-			data_file = f'{base_dir}/{host}-{sen}.json'
-			client = rest.RestClient(
-				server=server,
-				host=host,
-				sensor=sen)
+		if watcher.check():
+			debug(f'Configuration reloaded, {len(watcher.plan.sensors)} sensors')
+			scheduler.update(watcher.plan)
+		plan = watcher.plan
+		pairs = scheduler.due()
+		if pairs:
+			overruns = scheduler.stats['overruns']
+			started = time.monotonic()
+			outcome = collect(poller,plan.server,pairs,publisher,metrics)
+			hosts = {}
+			for (host,sen),ok in outcome:
+				hosts[host] = hosts.get(host,False) or ok
+			for host,ok in hosts.items():
+				scheduler.host_done(host,ok)
+			for pair,ok in outcome:
+				scheduler.done(pair)
+			metrics.cycle(time.monotonic() - started)
+			try:
+				info.write()
+			except OSError as e:
+				log(f'Cannot write sensor info: {e}')
+			if scheduler.stats['overruns'] != overruns:
+				debug(f'reads overran their interval, {scheduler.stats}')
+		if time.monotonic() >= metrics_due:
+			metrics_due += metrics_interval
 			try:
-				sensor_data = client.read()
-				if not 'error' in sensor_data:
-					with open(data_file,'w') as f:
-						debug("Writing",data_file)
-						json.dump(sensor_data,f,indent=2)
-			except Exception as e:
-				with open('/tmp/get-data.log','a') as f:
-					log(f'Exception getting data for {host}-{sen}: {e}')
+				metrics.write(metrics_path)
+			except OSError as e:
+				log(f'Cannot write metrics: {e}')
+		''' sleep until the next sensor is due, looking for config changes at least every poll interval '''
+		wake = time.monotonic() + plan.poll_interval
+		next_due = scheduler.next_due()
+		if next_due is not None:
+			wake = min(wake,next_due)
+		time.sleep(max(0,wake - time.monotonic()))
 
 if __name__ == "__main__":
 	parser = argparse.ArgumentParser(
@@ -1,9 +1,10 @@
-import os
 import gi
 gi.require_version('Gtk', '3.0')
 from gi.repository import Gtk, Gdk, GdkPixbuf
 
 from dflib.debug import debug
+from dflib import pixcache
+from dflib import widgets
 
 class IconWindow(Gtk.ScrolledWindow):
 	def __init__(self, **kwargs):
@@ -17,6 +18,7 @@ class IconWindow(Gtk.ScrolledWindow):
 		self.info_menu = False
 		self.add_item_callback = False
 		self.pixmap = {}
+		self._rows = {}
 		self.sort_dir = Gtk.SortType.ASCENDING
 		self.sort_column = 1
 		self.activate_on_single_click = False
@@ -46,8 +48,7 @@ class IconWindow(Gtk.ScrolledWindow):
 		self.icon_view.connect("button-press-event", self.on_icon_button_press)
 
 		# Apply CSS styling to control padding around icons
-		self.css_provider = Gtk.CssProvider()
-		self.css_provider.load_from_data(b".view .cell { padding: 2px; }")  # Adjust padding value as needed
+		self.css_provider = widgets.css_provider(b".view .cell { padding: 2px; }")  # Adjust padding value as needed
 		self.style_context = self.icon_view.get_style_context()
 		self.style_context.add_provider(self.css_provider, Gtk.STYLE_PROVIDER_PRIORITY_USER)
 
@@ -68,89 +69,107 @@ class IconWindow(Gtk.ScrolledWindow):
 			del self.icon_dict[old]
 			self.icon_dict[new] = tmp
 
-	def _get_icon_store_by_name(self,name):
-		index = 0
-		for row in self.icon_store:
-			if row[1] == name:
-				return index
-			index += 1
-		return False
-
-	def _signal_row_change(self, index):
-		tree_path = Gtk.TreePath.new_from_indices([index])
-		iter = self.icon_store.get_iter(tree_path)
-		self.icon_store.emit('row-changed',tree_path, iter)
+	def _get_icon_row(self,name):
+		'''
+		return the tree iter of the row for name, or None. Rows are found
+		through the name index so this does not scan the store.
+		'''
+		ref = self._rows.get(name)
+		if ref and ref.valid():
+			return self.icon_store.get_iter(ref.get_path())
+		return None
 
 	def activate_icon(self,name):
-		index = self._get_icon_store_by_name(name)
-		if type(index) is int:
-			row = self.icon_store[index]
+		row = self._get_icon_row(name)
+		if row:
 			active_icon = self.pixmap[name]['active']
-			icon_name = self.pixmap[name]['icon_name']
-			debug(f"""
-			activating: {name}
-			icon_name: {icon_name}
-			setting active: {active_icon}
-			active set: {self.pixmap[name]['active']}
-			inactive set: {self.pixmap[name]['inactive']}
-			""")
-			row[0] = active_icon
-			self._signal_row_change(index)
+			debug(f'activating: {name} icon_name: {self.pixmap[name]["icon_name"]}')
+			self.icon_store.set_value(row,0,active_icon)
 		else:
-			debug('bad index',type(index),index)
+			debug('no row for',name)
 	
 	def deactivate_icon(self,name):
-		index = self._get_icon_store_by_name(name)
-		if type(index) is int:
-			row = self.icon_store[index]
+		row = self._get_icon_row(name)
+		if row:
 			inactive_icon = self.pixmap[name]['inactive']
-			debug(name,row[1],row[0],inactive_icon)
-			row[0] = inactive_icon
-			self._signal_row_change(index)
+			debug(name,inactive_icon)
+			self.icon_store.set_value(row,0,inactive_icon)
 
 	def update_icon(self,old_name, new_name, icon_name):
-		if old_name in self.icon_dict:
-			del self.icon_dict[old_name]
-		self.icon_dict[new_name] = {'name': new_name, 'icon': icon_name}
-		self.create_icons()
+		'''
+		rename the icon for old_name to new_name and change its image to
+		icon_name. Only that row is touched, images are only loaded if the
+		icon file changed.
+		'''
+		''' merge into the existing entry so keys like type survive, it may already be renamed '''
+		value = dict(self.icon_dict.pop(old_name,None) or self.icon_dict.get(new_name) or {})
+		value.update({'name': new_name, 'icon': icon_name})
+		self.icon_dict[new_name] = value
+		row = self._get_icon_row(old_name)
+		if not row and old_name != new_name:
+			''' already renamed, just bring the image up to date '''
+			old_name = new_name
+			row = self._get_icon_row(old_name)
+		if not row:
+			self._append_icon(value)
+			return
+		pixmap = self.pixmap.pop(old_name)
+		active = self._is_active(old_name) or self._is_active(new_name)
+		if pixmap['icon_name'] != icon_name:
+			pixmap = self._make_pixmap(icon_name)
+		self.pixmap[new_name] = pixmap
+		self.icon_store.set(row,[0,1],[pixmap['active'] if active else pixmap['inactive'], new_name])
+		self._rows[new_name] = self._rows.pop(old_name)
 	
 	def delete_icon(self,item):
 		if item in self.icon_dict:
 			del self.icon_dict[item]
-			self.icon_store.clear()
-			self.create_icons()
-			debug("icon removed and list regenderated")
+			row = self._get_icon_row(item)
+			if row:
+				self.icon_store.remove(row)
+			self._rows.pop(item,None)
+			self.pixmap.pop(item,None)
+			debug("icon removed")
 		else:
 			debug(f"no {item} in {self.icon_dict}")
 
 	def add_icon(self,icon,item):
 		self.icon_dict[item] = {'name': item, 'icon': icon}
-		self.create_icons()
+		if item in self._rows:
+			self.update_icon(item,item,icon)
+		else:
+			self._append_icon(self.icon_dict[item])
+
+	def _make_pixmap(self,icon_name):
+		''' inactive and active pixbufs for the icon file icon_name '''
+		(icon_pixbuf_inactive,icon_pixbuf_active) = self.get_icon_image(icon_name)
+		return {
+			"icon_name": icon_name,
+			"active": icon_pixbuf_active, 
+			"inactive": icon_pixbuf_inactive}
+
+	def _is_active(self,name):
+		''' True if name has an open detail window '''
+		return bool(self.active_windows) and name in self.active_windows
+
+	def _append_icon(self,value):
+		''' add a row for the icon_dict entry value and index it by name '''
+		name = value['name']
+		self.pixmap[name] = pixmap = self._make_pixmap(value['icon'])
+		if self._is_active(name):
+			pimage = pixmap['active']
+		else:
+			pimage = pixmap['inactive']
+		row = self.icon_store.append([pimage, name, value.get('type','icon')])
+		self._rows[name] = Gtk.TreeRowReference.new(self.icon_store,self.icon_store.get_path(row))
 
 	def create_icons(self):
 		self.icon_store.clear()
+		self._rows = {}
+		self.pixmap = {}
 		for key, value in self.icon_dict.items():
-			iaipath = value['icon']
-			aipath,ext = os.path.splitext(iaipath)
-			aipath = f'{aipath}-active{ext}'
-			#icon_pixbuf_active = GdkPixbuf.Pixbuf.new_from_file(aipath)
-			#icon_pixbuf_inactive = GdkPixbuf.Pixbuf.new_from_file(value["icon"])
-			(icon_pixbuf_inactive,icon_pixbuf_active) = \
-				self.get_icon_image(value['icon'])
-			self.pixmap[value['name']] = {
-				"icon_name": value['icon'],
-				"active": icon_pixbuf_active, 
-				"inactive": icon_pixbuf_inactive}
-
-			if self.active_windows and value['name'] in self.active_windows:
-				pimage = icon_pixbuf_active
-			else:
-				pimage = icon_pixbuf_inactive
-			if 'type' in value:
-				self.icon_store.append([pimage, value["name"], value['type']])
-			else:
-				self.icon_store.append([pimage, value["name"], "icon"])
-			self.sort_by_name()
+			self._append_icon(value)
+		self.sort_by_name()
 
 	def on_icon_button_press(self, widget, event):
 		if event.button == Gdk.BUTTON_SECONDARY:
@@ -373,40 +392,20 @@ class IconWindow(Gtk.ScrolledWindow):
 	def get_icon_image(self,image1_path):
 		'''
 		Create a suitable icon from a file for both regular and acive by 
-		applying an image with the active badge to the source. Return both GdkPixbufs
+		applying an image with the active badge to the source. Return both GdkPixbufs.
+		The images come from the process wide pixbuf cache, so each icon file
+		is only decoded and composited once. An outdated thumbnail may be
+		returned at first, the row is updated when the icon is rendered again.
 		'''
-		# Load images
-		image2_path = os.path.join(os.path.dirname(image1_path),"active_badge.png")
-		image1 = GdkPixbuf.Pixbuf.new_from_file(image1_path)
-		image2 = GdkPixbuf.Pixbuf.new_from_file(image2_path)
-
-		# Scale image1 to the desired dimensions
-		scaled_image1 = image1.scale_simple(64, 64, GdkPixbuf.InterpType.BILINEAR)
-
-		# Create a new transparent image to composite onto
-		composite_image = GdkPixbuf.Pixbuf.new(GdkPixbuf.Colorspace.RGB, True, 8, 64, 64)
-		composite_image.fill(0x000000)  # Fill with black
-
-		# Draw scaled_image1 onto the composite image
-		scaled_image1.copy_area(0, 0, 64, 64, composite_image, 0, 0)
-
-		# Calculate position to center image2 on composite_image
-		x_offset = (64 - image2.get_width()) // 2
-		y_offset = (64 - image2.get_height()) // 2
-
-		# Draw image2 onto the composite image
-		image2.composite(
-			composite_image,
-			x_offset,
-			y_offset,
-			image2.get_width(),
-			image2.get_height(),
-			x_offset,
-			y_offset,
-			1,
-			1,
-			GdkPixbuf.InterpType.BILINEAR,
-			255,
-		)
-		return (scaled_image1, composite_image)
-
+		return pixcache.icon_variants(image1_path,on_rebuilt=self._on_icon_rebuilt)
+
+	def _on_icon_rebuilt(self,icon_name):
+		''' a fresh rendering of icon_name is ready, show it in every row using it '''
+		for name,pixmap in list(self.pixmap.items()):
+			if pixmap['icon_name'] != icon_name:
+				continue
+			row = self._get_icon_row(name)
+			self.pixmap[name] = pixmap = self._make_pixmap(icon_name)
+			if row:
+				self.icon_store.set_value(row,0,pixmap['active'] if self._is_active(name) else pixmap['inactive'])
+		return False
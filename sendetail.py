@@ -6,17 +6,138 @@ import sys
 import time
 import json
 import gi
+from concurrent.futures import ThreadPoolExecutor
 gi.require_version('Gtk', '3.0')
-from gi.repository import Gtk, GLib, GdkPixbuf
+from gi.repository import Gtk, GLib, GdkPixbuf, Gio
 
 sys.path.append(os.path.expanduser('~/lib'))
 prog_dir = os.path.dirname(os.path.realpath(sys.argv[0])) 
 sys.path.append(prog_dir)
 
 data_path = '/Volumes/RamDisk/sensordata'
+store_file = 'sensors.shm'
+info_file = 'sensorinfo.json'
 
 from dflib import widgets, rest
 from dflib.debug import debug
+from dflib.shmstore import SensorStore
+from dflib.push import PushClient
+from dflib.sensorinfo import SensorInfo
+
+push_socket = '/tmp/get-data.sock'
+_store = None
+_push = None
+_info = None
+_watcher = None
+
+def get_store():
+	'''
+	return the memory mapped store shared with the daemon, opening it on first use
+	'''
+	global _store
+	if not _store:
+		_store = SensorStore(os.path.join(data_path,store_file))
+	return _store
+
+class DataWatcher(object):
+	'''
+	One Gio directory monitor on data_path shared by every window. Windows
+	watch the {host}-{sensor}.json file of their sensor and their callback
+	is called on the main loop whenever the daemon publishes a new one.
+	active is False if the directory cannot be monitored.
+	'''
+	def __init__(self,path):
+		self.path = path
+		self.active = False
+		self._watches = {}
+		self._monitor = None
+		try:
+			directory = Gio.File.new_for_path(path)
+			self._monitor = directory.monitor_directory(Gio.FileMonitorFlags.WATCH_MOVES,None)
+			self._monitor.connect('changed',self._on_changed)
+			self.active = True
+		except GLib.Error as e:
+			debug(f'cannot monitor {path}: {e}')
+
+	def watch(self,host,sensor,callback):
+		''' call callback() when the file for host and sensor is replaced '''
+		self._watches.setdefault(f'{host}-{sensor}.json',[]).append(callback)
+
+	def unwatch(self,host,sensor,callback):
+		''' stop calling callback for host and sensor '''
+		name = f'{host}-{sensor}.json'
+		callbacks = self._watches.get(name,[])
+		if callback in callbacks:
+			callbacks.remove(callback)
+		if not callbacks:
+			self._watches.pop(name,None)
+
+	def _on_changed(self,monitor,changed,other,event):
+		'''
+		the daemon renames a temporary file over the data file, so a new
+		file shows up as a rename (or move in) to its name
+		'''
+		if event in [Gio.FileMonitorEvent.RENAMED, Gio.FileMonitorEvent.MOVED_IN]:
+			target = other if event == Gio.FileMonitorEvent.RENAMED else changed
+		elif event == Gio.FileMonitorEvent.CHANGES_DONE_HINT:
+			target = changed
+		else:
+			return
+		if not target:
+			return
+		for callback in list(self._watches.get(target.get_basename(),[])):
+			callback()
+
+def get_watcher():
+	''' return the data_path watcher, creating it on first use '''
+	global _watcher
+	if not _watcher:
+		_watcher = DataWatcher(data_path)
+	return _watcher
+
+def get_info(host,sensor):
+	'''
+	return the metadata the daemon has captured for host and sensor, an
+	empty dict if it has not seen the sensor yet
+	'''
+	global _info
+	if not _info:
+		_info = SensorInfo(os.path.join(data_path,info_file))
+	info = _info.lookup(host,sensor)
+	if not info:
+		data = get_store().read(host,sensor)
+		if data:
+			info = {k: data[k] for k in ['modinfo','description'] if k in data}
+	return info
+
+def get_push():
+	'''
+	return the push client for the daemon's socket. On first use it is
+	connected and watched on the GLib main loop; if the daemon is not
+	there a reconnect is tried every 5 seconds.
+	'''
+	global _push
+	if not _push:
+		_push = PushClient(push_socket)
+		_push_connect()
+		GLib.timeout_add_seconds(5,_push_reconnect)
+	return _push
+
+def _push_connect():
+	''' connect the push client and add its socket to the main loop '''
+	if _push.connect():
+		condition = GLib.IO_IN | GLib.IO_HUP | GLib.IO_ERR
+		GLib.io_add_watch(_push.fileno(),GLib.PRIORITY_DEFAULT,condition,_on_push_input)
+
+def _on_push_input(fd,condition):
+	''' dispatch pushed readings, drop the watch if the connection is gone '''
+	return _push.handle_input()
+
+def _push_reconnect():
+	''' periodic check to reconnect to the daemon '''
+	if not _push.connected:
+		_push_connect()
+	return True
 
 ''' Colors for dark mode '''
 dark_mode_colors = {
@@ -45,41 +166,240 @@ light_mode_colors = {
 	'temp_blue': 	'#000040'
 }
 
+''' keys shown in italics, keys colored by temperature '''
+italic_keys = ['description','modinfo']
+temperature_keys = ['high', 'low','temp','tempc']
+
+def _format_value(k,v):
+	''' text for any value without a formatter of its own '''
+	if type(v) is float:
+		return '{:.2f}'.format(v)
+	return v
+
+def _format_italic(k,v):
+	return f'<i>{v}</i>'
+
+def _format_time(k,v):
+	return time.strftime('%D %T',time.localtime(v))
+
+def _format_boot_time(k,v):
+	v = int(time.time()) - int(v)
+	v = time.strftime('%D %T',time.localtime(v))
+	return ':'.join(v.split(':')[:-1])
+
+def _format_loadavg(k,v):
+	return ', '.join(['{:.2f}'.format(v[i]) for i in range(0,3)])
+
+value_formatters = {
+	'time': _format_time,
+	'boot_time': _format_boot_time,
+	'loadavg': _format_loadavg,
+}
+
+def _field_formatter(k):
+	'''
+	compile the formatter for key k: a function of (k, v, keycolors, key_color)
+	returning the markup line for the field
+	'''
+	if k in italic_keys:
+		format_value = _format_italic
+	else:
+		format_value = value_formatters.get(k,_format_value)
+	def format_field(k,v,keycolors,key_color):
+		color = keycolors.get(k,key_color)
+		if k in temperature_keys and type(v) is float:
+			if v < 60:
+				color = keycolors['temp_blue']
+			elif v >= 80:
+				color = keycolors['temp_red']
+			else:
+				color = keycolors['temp_green']
+		return f'<span foreground="{key_color}">{k}</span>: <span foreground="{color}">{format_value(k,v)}</span>\n'
+	return format_field
+
+''' compiled layouts by the keys of a reading, each sensor type has its own key set '''
+_layouts = {}
+
+def field_layout(keys):
+	'''
+	return the list of (key, formatter) for a reading with keys (a tuple),
+	compiled on first use
+	'''
+	if not keys in _layouts:
+		_layouts[keys] = [(k,_field_formatter(k)) for k in keys]
+	return _layouts[keys]
+
+''' counts of sensor file reads done on the worker, retries are reads of a file that did not parse '''
+read_stats = {
+	'reads': 0,
+	'retries': 0,
+	'failures': 0
+}
+_read_pool = ThreadPoolExecutor(max_workers=2,thread_name_prefix='sensor-read')
+
 class PsuedoSensor:
 	'''
 	Since the data collection is done by a daemon process, this class provides 
 	the rquired sensor interface to read sensor data from a ramdisk. 
+	The sensor file is read on a worker thread so the main loop never waits
+	on it; read() returns the last good reading meanwhile and callback, if
+	given, is called on the main loop as callback(host, sensor, reading)
+	with each fresh reading from the file.
 	'''
 	def __init__(self,**kwargs):
 		self.sensor = None
 		self.host = None
 		self.base_path = data_path
+		self.callback = None
+		self.last = None
+		self._pending = False
 		for k,v in kwargs.items():
 			setattr(self,k,v)
 
 	def read(self):
 		'''
-		read data, allowing for race conditions on sensor files
+		read data from the shared store. If it is not there start a read of
+		the sensor file in the background and return the last good reading.
+		'''
+		data = get_store().read(self.host,self.sensor)
+		if data:
+			self.last = data
+			return data
+		if not self._pending:
+			self._pending = True
+			_read_pool.submit(self._read_file)
+		return self.last
+
+	def _read_file(self):
+		'''
+		worker thread: read the sensor file, allowing for race conditions on
+		it, and hand the result to the main loop
 		'''
 		tries = 0
 		dpath = os.path.join(self.base_path,f'{self.host}-{self.sensor}.json')
 		data = None
-		while not data:
-			try:
-				with open(dpath) as f:
-					data = json.load(f)
-			except json.decoder.JSONDecodeError:
-				tries += 1
-				data = None
-				time.sleep(.3)
-				if tries > 5:
-					return None
-		return data
-			
+		try:
+			while not data:
+				try:
+					with open(dpath) as f:
+						data = json.load(f)
+				except json.decoder.JSONDecodeError:
+					tries += 1
+					read_stats['retries'] += 1
+					data = None
+					if tries > 5:
+						break
+					time.sleep(.3)
+				except OSError as e:
+					debug(f'cannot read {dpath}: {e}')
+					break
+		except Exception as e:
+			debug(f'cannot read {dpath}: {e}')
+			data = None
+		finally:
+			''' always hand back, _on_file_read clears the pending flag '''
+			read_stats['reads'] += 1
+			if not data:
+				read_stats['failures'] += 1
+			GLib.idle_add(self._on_file_read,data)
+
+	def _on_file_read(self,data):
+		''' main loop: keep a good reading and pass it on '''
+		self._pending = False
+		if data:
+			self.last = data
+			if callable(self.callback):
+				self.callback(self.host,self.sensor,data)
+		return False
+
+def usable_detail(detail,what=''):
+	''' return detail if it is a reading without an error, otherwise None '''
+	if type(detail) is dict:
+		if 'error' in detail:
+			return None
+	else:
+		debug(what,"returned data is not dict",detail)
+		return None
+	return detail
+
+class RefreshDispatcher(object):
+	'''
+	One main loop timer for every SenDetail window. On each tick the sensors
+	the windows need are read once each (REST sensors in a single read_many)
+	and every window is updated from the same callback, so the main loop
+	wakes once per poll interval however many windows are open. The timer
+	runs only while windows are registered and follows changes to the
+	poll_interval setting.
+	'''
+	def __init__(self):
+		self.windows = []
+		self._timer = None
+		self._interval = None
+
+	def add(self,window):
+		''' register window and start the timer if it is not running '''
+		if not window in self.windows:
+			self.windows.append(window)
+		self._schedule(window.config['poll_interval'])
+
+	def remove(self,window):
+		''' unregister window, the timer stops with the last one '''
+		if window in self.windows:
+			self.windows.remove(window)
+		if not self.windows and self._timer:
+			GLib.source_remove(self._timer)
+			self._timer = None
+
+	def _schedule(self,interval):
+		''' (re)start the timer at interval ms unless it already runs at that rate '''
+		if self._timer and interval == self._interval:
+			return
+		if self._timer:
+			GLib.source_remove(self._timer)
+		self._interval = interval
+		self._timer = GLib.timeout_add(interval,self.tick)
+
+	def read(self,windows):
+		''' read every sensor the windows want, each once. Return {(host, sensor): detail} '''
+		readings = {}
+		rest_pairs = []
+		for w in windows:
+			key = (w.host,w.sensor_name)
+			if key in readings or key in rest_pairs or not w.wants_read():
+				continue
+			if w._use_rest:
+				rest_pairs.append(key)
+			else:
+				readings[key] = usable_detail(w.sensor.read(),f'{key[0]}::{key[1]}')
+		if rest_pairs:
+			client = rest.RestClient(server=windows[0].server,host='none',sensor='none')
+			for key,detail in zip(rest_pairs,client.read_many(rest_pairs)):
+				readings[key] = usable_detail(detail,f'{key[0]}::{key[1]}')
+		return readings
+
+	def tick(self):
+		''' read what is needed and update every window '''
+		windows = [w for w in self.windows if w.keepgoing]
+		readings = self.read(windows)
+		for w in windows:
+			w.update(readings.get((w.host,w.sensor_name)))
+		if not self.windows:
+			self._timer = None
+			return False
+		interval = self.windows[0].config['poll_interval']
+		if interval != self._interval:
+			self._timer = None
+			self._schedule(interval)
+			return False
+		return True
+
+dispatcher = RefreshDispatcher()
+
 class SenDetail(Gtk.Window):
 	'''
 	This class implements the sensor detail window. 
-	The specified sensor is read every config['poll_interval'] seconds.
+	The specified sensor is read every config['poll_interval'] milliseconds
+	by the shared RefreshDispatcher.
 	When the window is created it is positioned based on the position 
 	parameter. Window movement is tracked and reported to the caller. 
 	The keyword arguments for this class are:
@@ -106,6 +426,12 @@ class SenDetail(Gtk.Window):
 		self._data_thread = None
 		self._data_q = None
 		self._command_q = None
+		self.keycolors = None
+		self.dark_mode = None
+		self._shown = False
+		self._last_detail = None
+		self._fields = {}
+		self._markup = None
 		for k,v in kwargs.items():
 			if k in ['config','host','sensor_name','title','callback','position','move_callback']:
 				setattr(self,k,v)
@@ -123,13 +449,10 @@ class SenDetail(Gtk.Window):
 			self.config['poll_interval'] = 300
 
 		debug(self.sensor_name,'interval', self.config['poll_interval'])
-		self.server = self.config['server']
-		if self._use_rest:
-			self.sensor = rest.RestClient(server=self.server,sensor=self.sensor_name,host=self.host)
-		else:
-			self.sensor = PsuedoSensor(server=self.server,sensor=self.sensor_name,host=self.host)
+		self._make_sensor()
 		Gtk.Window.__init__(self, title=self.title)
 		self.connect("delete-event", self.stopit)
+		self.connect("destroy", self.on_destroy)
 		self.keepgoing = True
 		self.vbox = Gtk.Box(orientation=Gtk.Orientation.VERTICAL)
 		self.label = Gtk.Label()
@@ -140,7 +463,8 @@ class SenDetail(Gtk.Window):
 		window_icon = GdkPixbuf.Pixbuf.new_from_file('icons/humidity.png')
 		self.set_icon(window_icon)
 		self.show_all()
-		self.update()
+		self.update(self.read_sensor())
+		dispatcher.add(self)
 
 	def change_sensor(self, title, host, sensor):
 		'''
@@ -148,12 +472,56 @@ class SenDetail(Gtk.Window):
 		'''
 		self.title = title
 		self.set_title(title)
+		self._drop_sensor()
 		self.host = host
 		self.sensor_name = sensor
-		self.server = self.config['server']
-		self.sensor = rest.RestClient(server=self.server,sensor=self.sensor_name,host=self.host)
+		self._last_detail = None
+		self._make_sensor()
 		debug(self.server,title, host, sensor)
 
+	def _make_sensor(self):
+		'''
+		create the sensor interface for host and sensor_name. Without REST
+		the window subscribes to pushed readings from the daemon.
+		'''
+		self.server = self.config['server']
+		if self._use_rest:
+			self.sensor = rest.RestClient(server=self.server,sensor=self.sensor_name,host=self.host)
+		else:
+			self.sensor = PsuedoSensor(server=self.server,sensor=self.sensor_name,host=self.host,callback=self.on_file_read)
+			get_push().subscribe(self.host,self.sensor_name,self.on_push)
+			get_watcher().watch(self.host,self.sensor_name,self.on_file_changed)
+
+	def _drop_sensor(self):
+		''' stop receiving pushed readings for the current sensor '''
+		if not self._use_rest:
+			get_push().unsubscribe(self.host,self.sensor_name,self.on_push)
+			get_watcher().unwatch(self.host,self.sensor_name,self.on_file_changed)
+
+	def on_push(self,detail):
+		''' a new reading was pushed by the daemon or read from its file '''
+		if self.keepgoing:
+			self.show_detail(detail)
+
+	def on_file_read(self,host,sensor,detail):
+		'''
+		a sensor file read finished. It may have been started for the sensor
+		shown before change_sensor(), such readings are dropped.
+		'''
+		if (host,sensor) == (self.host,self.sensor_name):
+			self.on_push(detail)
+
+	def on_file_changed(self):
+		''' the daemon published a new data file for our sensor '''
+		if self.keepgoing and not get_push().connected:
+			self.on_push(self.sensor.read())
+
+	def on_destroy(self,*args):
+		''' window is gone, stop updates '''
+		self.keepgoing = False
+		dispatcher.remove(self)
+		self._drop_sensor()
+
 	def do_iconify(self,*args):
 		'''
 		Hide a window if not hidden
@@ -223,27 +591,43 @@ class SenDetail(Gtk.Window):
 		''' reas the sensor and return data unless there's an error in the data
 		'''
 		we = f'{self.sensor.host}::{self.sensor.sensor}'
-		detail = self.sensor.read()
-		if type(detail) is dict:
-			if 'error' in detail:
-				return None
-		else:
-			debug(we,"returned data is not dict",detail)
-			return None
-		return detail
+		return usable_detail(self.sensor.read(),we)
 
+	def wants_read(self):
+		'''
+		True unless readings are pushed by the daemon or new data files are
+		noticed by the data_path watcher
+		'''
+		if self._use_rest or not self._shown:
+			return True
+		return not (get_push().connected or get_watcher().active)
 
-	def update(self):
+	def update(self,detail=None):
 		'''
-		This is out main worker.
+		This is out main worker, called by the dispatcher every poll interval.
 		First we check for dark_mode and set css accordingly. 
-		We read the sensor and if data is returned format it 
-		based on keys and colors. Once complete set a new timeout 
-		to do this all over again.
+		If the dispatcher read the sensor for us, show it.
 		'''
-		if 'dark_mode' not in self.config:
-			self.dark_mode = False
-		self.dark_mode = self.config['dark_mode']
+		if self.apply_theme():
+			''' colors changed, everything has to be formatted again '''
+			detail = detail or self._last_detail
+			self._last_detail = None
+			self._fields = {}
+		if detail:
+			self.show_detail(detail)
+
+		if not self._initial_position_set:
+			self.set_window_position()
+
+	def apply_theme(self):
+		'''
+		set colors and css for dark_mode. Nothing is done unless dark_mode
+		changed since the last call. Return True if it changed.
+		'''
+		dark_mode = self.config.get('dark_mode',False)
+		if dark_mode == self.dark_mode:
+			return False
+		self.dark_mode = dark_mode
 		if self.dark_mode:
 			self.key_color = '#7f7f7f'
 			self.keycolors = dark_mode_colors
@@ -254,57 +638,46 @@ class SenDetail(Gtk.Window):
 			bgc = 'white'
 
 		css_data = '.sdetail {font-family: Ariel; font-size: 22px;  background-color: @bgc; padding: 15px; }'.replace('@bgc',bgc)
-
 		widgets._widget_set_css(self.label, 'sdetail', css_data)
-		key_color = self.key_color
-		dark_mode = self.dark_mode
-		detail = self.read_sensor()
-		if detail and not 'error' in detail:
-			detail['name'] = self.sensor_name
-			s = ''
-			for k,v in detail.items():
-				if k == 'description' or k == 'modinfo':
-					v = f'<i>{v}</i>'
-
-				if k == 'time':
-					v = time.strftime('%D %T',time.localtime(v))
-				if k == 'boot_time':
-					v = int(time.time()) - int(v)
-					v = time.strftime('%D %T',time.localtime(v))
-					v = ':'.join(v.split(':')[:-1])
-
-				if k in self.keycolors:
-					color = self.keycolors[k]
-				else:
-					color = key_color
-				if k == 'loadavg':
-					la = []
-					for i in range(0,3):
-						la.append('{:.2f}'.format(v[i]))
-					v = ', '.join(la)
-
-				if type(v) is float:
-					if k  in ['high', 'low','temp','tempc']:
-						if v < 60:
-							color = self.keycolors['temp_blue']
-						elif v >= 80:
-							color = self.keycolors['temp_red']
-						else:
-							color = self.keycolors['temp_green']
-
-					v = '{:.2f}'.format(v)
-				s = s + f'<span foreground="{key_color}">{k}</span>: '
-				s = s + f'<span foreground="{color}">{v}</span>\n'
-			try:
-				self.label.set_markup(s)
-			except:
-				debug(f'Markup error: {s}')
-				self.keepgoing = False
-				return
-
-		if not self._initial_position_set:
-			self.set_window_position()
+		return True
 
-		if self.keepgoing:
-			interval = self.config['poll_interval']
-			GLib.timeout_add(interval, self.update)
+	def show_detail(self,detail):
+		'''
+		format detail based on keys and colors and show it. Nothing is done
+		if the reading has the same timestamp (or, without one, the same 
+		contents) as the one shown, and only fields whose value changed
+		are formatted again.
+		'''
+		if not self.keycolors:
+			return
+		if not detail or 'error' in detail:
+			return
+		detail = dict(detail)
+		detail['name'] = self.sensor_name
+		stamp = detail.get('time')
+		if self._last_detail is not None:
+			if stamp is not None and stamp == self._last_detail.get('time'):
+				return
+			if detail == self._last_detail:
+				return
+		lines = []
+		for k,fmt in field_layout(tuple(detail)):
+			v = detail[k]
+			cached = self._fields.get(k)
+			if cached and cached[0] == v:
+				lines.append(cached[1])
+				continue
+			line = fmt(k,v,self.keycolors,self.key_color)
+			self._fields[k] = (v,line)
+			lines.append(line)
+		s = ''.join(lines)
+		self._last_detail = detail
+		if s == self._markup:
+			return
+		try:
+			self.label.set_markup(s)
+			self._markup = s
+			self._shown = True
+		except:
+			debug(f'Markup error: {s}')
+			self.keepgoing = False
@@ -4,34 +4,59 @@ Module to edit sensor definitons
 import os
 import gi
 import json
+from concurrent.futures import ThreadPoolExecutor
 gi.require_version('Gtk', '3.0')
-from gi.repository import Gtk, Gdk, GdkPixbuf
+from gi.repository import Gtk, Gdk, GdkPixbuf, GLib
 from iconbox import IconWindow
 from dflib import widgets
 from dflib.debug import debug
 from dflib import rest
 
-def sensorHosts(server):
+''' seconds to wait for one host to answer during discovery '''
+discovery_timeout = 3
+_discovery_pool = ThreadPoolExecutor(max_workers=8,thread_name_prefix='discovery')
+
+def sensorHosts(server,timeout=10,refresh=False):
 	'''
 	use REST client to retrieve list of sensor hosts
 	'''
 	global config
 	debug(f'sensorHosts: server={server}')
-	h = rest.RestClient(server=server,host='none',sensor='none')
-	hosts = h.hosts()
+	h = rest.RestClient(server=server,host='none',sensor='none',timeout=timeout)
+	hosts = h.hosts(refresh)
+	if type(hosts) is not list:
+		debug(f'no hosts from {server}: {hosts}')
+		return []
 	hosts.sort()
 	return hosts
 
-def sensorsOnHost(server,host):
+def sensorsOnHost(server,host,timeout=10,refresh=False):
 	'''
 	use REST client to retrieve list of seonsor for a given host
 	'''
 	global config
-	h = rest.RestClient(server=server,host=host,sensor='none')
-	sensors = h.list()
+	h = rest.RestClient(server=server,host=host,sensor='none',timeout=timeout)
+	sensors = h.list(refresh)
+	if type(sensors) is not list:
+		debug(f'no sensors from {host}: {sensors}')
+		return []
 	sensors.sort()
 	return sensors
 
+def cachedSensors(server):
+	'''
+	hosts and a dict of sensors per host from the discovery cache, without
+	using the network
+	'''
+	hosts = rest.RestClient(server=server,host='none',sensor='none').cached_hosts() or []
+	hosts.sort()
+	sensors = {}
+	for host in hosts:
+		cached = rest.RestClient(server=server,host=host,sensor='none').cached_list()
+		if cached:
+			sensors[host] = sorted(cached)
+	return hosts, sensors
+
 class IconSelector(Gtk.Window):
 	'''
 	This class creates a window with an IconWindow from a dict of icon
@@ -104,18 +129,17 @@ class SensorEditor(Gtk.Window):
 
 
 		self.connect('delete-event',self.on_wm_delete_event)
-		self.sensors = {}
-		self.hosts = sensorHosts(self.config['server'])
-		for h in self.hosts:
-			self.sensors[h] = sensorsOnHost(self.config['server'],h)
+		self.connect('destroy',self.on_destroy)
+		self._closed = False
+		self.hosts, self.sensors = cachedSensors(self.config['server'])
 		if self.name:
 			self.host = self.sensor['host']
 			self.sendev = self.sensor['sensor']
 			imgpath = os.path.join(self.prog_dir,self.sensor['icon'])
 		else:
 			imgpath = os.path.join(self.prog_dir,'icons/select.png')
-			self.host = self.hosts[0]
-			self.sendev = self.sensors[self.host][0]
+			self.host = None
+			self.sendev = None
 
 		img =  Gtk.Image.new_from_file(imgpath)
 		img.set_size_request(64, 64)
@@ -164,20 +188,20 @@ class SensorEditor(Gtk.Window):
 		ibox.pack_start(self.icon,False,False,10)
 		vbox.pack_start(ibox,True,True,0)
 		self.icon.connect('clicked',self.select_icon)
-		self.host_box = widgets.ListBox(self.hosts,onActivate=self.on_select_host)
-		if self.name:
-			self.host_box.select_row_by_label(self.sensor['host'])
+		''' host and sensor lists start from the discovery cache, the server is only asked for what is missing or expired '''
+		self.host_box = widgets.ListBox([],onActivate=self.on_select_host)
 		center.pack_start(self.host_box,True,True,0)
-		self.sensor_box = widgets.ListBox(self.sensors[self.host],onActivate=self.on_select_sensor)
-		if self.name:
-			self.sensor_box.select_row_by_label(self.sensor['sensor'])
+		self.sensor_box = widgets.ListBox([],onActivate=self.on_select_sensor)
 		right.pack_start(self.sensor_box,True,True,0)
 		bbox = Gtk.Box(orientation=Gtk.Orientation.HORIZONTAL)
 		okbutton = Gtk.Button(label="Ok")
+		refreshbutton = Gtk.Button(label="Refresh")
 		cancelbutton = Gtk.Button(label="Cancel")
 		bbox.pack_start(okbutton,True,True,10)
+		bbox.pack_start(refreshbutton,True,True,10)
 		bbox.pack_start(cancelbutton,True,True,10)
 		okbutton.connect('clicked',self.on_ok_clicked)
+		refreshbutton.connect('clicked',self.on_refresh_clicked)
 		cancelbutton.connect('clicked',self.on_cancel_clicked)
 		vbox.pack_start(bbox,True,True,10)
 		self.add(vbox)
@@ -185,6 +209,60 @@ class SensorEditor(Gtk.Window):
 		self.set_icon(window_icon)
 		self.set_position(Gtk.WindowPosition.CENTER)
 		self.show_all()
+		self.on_hosts(self.hosts)
+		if self.host in self.sensors:
+			self.on_host_sensors(self.host,self.sensors[self.host])
+		if not self.hosts or any([host not in self.sensors for host in self.hosts]):
+			_discovery_pool.submit(self._discover_hosts,self.config['server'],self.hosts,False)
+
+	def _discover_hosts(self,server,cached_hosts,refresh):
+		'''
+		worker thread: get the host list, then the sensors of every host
+		concurrently. Cached answers that have not expired are used unless
+		refresh is set. Results are handed to the main loop as they come.
+		If the server does not answer the cached hosts are asked.
+		'''
+		hosts = sensorHosts(server,timeout=discovery_timeout,refresh=refresh)
+		GLib.idle_add(self.on_hosts,hosts)
+		for host in hosts or cached_hosts:
+			_discovery_pool.submit(self._discover_sensors,server,host,refresh)
+
+	def _discover_sensors(self,server,host,refresh):
+		''' worker thread: get the list of the sensors of one host '''
+		sensors = sensorsOnHost(server,host,timeout=discovery_timeout,refresh=refresh)
+		GLib.idle_add(self.on_host_sensors,host,sensors)
+
+	def on_hosts(self,hosts):
+		''' main loop: a host list arrived, an empty one does not replace what is shown '''
+		if self._closed:
+			return False
+		if not hosts and self.hosts:
+			return False
+		self.hosts = hosts
+		if hosts != self.host_box.items:
+			self.host_box.populate(hosts)
+		if not self.host and hosts:
+			self.host = hosts[0]
+		if self.host:
+			self.host_box.select_row_by_label(self.host)
+		return False
+
+	def on_host_sensors(self,host,sensors):
+		''' main loop: a sensor list for host arrived, an empty one does not replace what is shown '''
+		if self._closed:
+			return False
+		if not sensors and self.sensors.get(host):
+			return False
+		self.sensors[host] = sensors
+		if host == self.host and sensors != self.sensor_box.items:
+			self.sensor_box.populate(sensors)
+			if self.sendev:
+				self.sensor_box.select_row_by_label(self.sendev)
+		return False
+
+	def on_destroy(self,*args):
+		''' stop handling discovery results once the window is gone '''
+		self._closed = True
 
 	def select_icon(self,*args):
 		'''
@@ -219,6 +297,10 @@ class SensorEditor(Gtk.Window):
 		self.callback(self.name_in, self.sensor_in, name,self.sensor)
 		self.destroy()
 
+	def on_refresh_clicked(self,*args):
+		''' ask the server for hosts and sensors again, ignoring the discovery cache '''
+		_discovery_pool.submit(self._discover_hosts,self.config['server'],self.hosts,True)
+
 	def on_cancel_clicked(self,*args):
 		''' if cancel is clicked we just go away '''
 		self.destroy()
@@ -230,8 +312,8 @@ class SensorEditor(Gtk.Window):
 		'''
 		self.host = host;
 		self.sensor['host'] = host
-		debug(f'selected host {host}: {self.sensors[host]}')
-		self.sensor_box.populate(self.sensors[host])
+		debug(f'selected host {host}: {self.sensors.get(host)}')
+		self.sensor_box.populate(self.sensors.get(host,[]))
 		self.hostLabel.set_text(host)
 
 	def on_select_sensor(self,widget, sensor,*args):
@@ -239,6 +321,7 @@ class SensorEditor(Gtk.Window):
 		when a sensor is selected our 'being edited' sensor definition is modified
 		with the new sensor host 
 		'''
+		self.sendev = sensor
 		self.sensor['sensor'] = sensor
 		debug(f'Selected sensor is {self.sensor}')
 		self.sensorLabel.set_text(sensor)
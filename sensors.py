@@ -24,16 +24,21 @@ sys.path.append(prog_dir)
 os.chdir(prog_dir)
 
 from dflib import widgets, rest
+from dflib.cfgjson import ConfigStore
+from dflib import pixcache
 from dflib.theme import change_theme
 from dflib.debug import debug, set_debug, dpprint
 import sensoredit
 from sendetail import SenDetail
+import sendetail
 from about import AboutDialog
 from config import SensorsConfig
 from iconbox import IconWindow
 
 program_version="2.1.3 (15 April 2024)"
 pid_file = '/tmp/.sensors'
+discovery_file = '/tmp/.sensors-discovery.json'
+thumbnail_dir = os.path.expanduser('~/.cache/sensors/thumbnails')
 
 class Toolbar(Gtk.Toolbar):
 	''' Generate a toolbar of TooButtons. To create the toolbar, 
@@ -151,13 +156,11 @@ class Sensors(Gtk.Window):
 				self.open_detail_window(name)
 
 	def save_config(self):
-		''' Save program configuration '''
-		try:
-			os.unlink(config_file)
-		except:
-			pass
-		with open(config_file,'w') as f:
-			json.dump(self.config,f,indent=4)
+		'''
+		Save program configuration. The write is deferred and coalesced
+		by the config store, so calling this for every move is cheap.
+		'''
+		config_store.save()
 	
 	def on_configure_event(self, widget, event):
 		''' when the window is moved, save the position '''
@@ -347,6 +350,7 @@ class Sensors(Gtk.Window):
 		'''
 		When the window is closed perform a little cleanup
 		'''
+		config_store.flush()
 		if os.path.exists(pid_file):
 			os.unlink(pid_file)
 
@@ -354,13 +358,11 @@ class Sensors(Gtk.Window):
 		'''
 		when the get_info icon menu is clicked we build up a 
 		list of tuples. Each tuple is of label, data. 
-		This list is used to create and InfoWindow
+		This list is used to create and InfoWindow. Module and type come
+		from what the daemon has captured, the network is never used here.
 		'''
 		sensor = self.config['sensors'][item]
-		server = self.config['server']
-		sensor_name = sensor['sensor']
-		sensor_host = sensor['host']
-		sdata = rest.RestClient(server=server,host=sensor_host,sensor=sensor_name).read()
+		sdata = sendetail.get_info(sensor['host'],sensor['sensor'])
 		info = [
 			('Sensor Host',sensor['host']),
 			('Sensor',sensor['sensor']),
@@ -453,9 +455,16 @@ if __name__ == "__main__":
 		sys.exit(1)
 	args = parser.parse_args()
 	config_file = os.path.join(prog_dir,'sensors.json')
-	with open(config_file,"r") as f:
-		config = json.load(f)
+	config_store = ConfigStore(config_file)
+	config = config_store.load()
 	set_debug(args.debug)
+	rest.discovery.open(discovery_file)
+	pixcache.open_thumbnails(thumbnail_dir)
+	try:
+		with open('icons/icons.json') as f:
+			pixcache.prewarm([os.path.join(prog_dir,i['icon']) for i in json.load(f).values()])
+	except (OSError, ValueError) as e:
+		debug(f'cannot prewarm icons: {e}')
 	start_daemon = daemon = True
 	if not args.no_daemon:
 		debug('starting daemon')